@@ -0,0 +1,394 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import (
+    Channel,
+    InputPeerChannel,
+    Message,
+    MessageActionPinMessage,
+    MessageMediaUnsupported,
+    MessageReplyHeader,
+    MessageService,
+    PeerChannel,
+    PeerUser,
+    User,
+)
+from telethon.tl.types.messages import MessagesSlice
+
+BATCH_SIZE = 100
+
+
+@dataclass(frozen=True)
+class SyntheticChatSpec:
+    """Shape of a generated chat history."""
+
+    chat_id: int = 1
+    title: str = "synthetic"
+    messages: int = 100_000
+    users: int = 5_000
+    days: int = 7
+    # Zipf exponent of the sender distribution; 0 means uniform.
+    sender_skew: float = 1.1
+    bot_ratio: float = 0.01
+    deleted_ratio: float = 0.01
+    no_username_ratio: float = 0.2
+    action_ratio: float = 0.01
+    reply_ratio: float = 0.2
+    media_ratio: float = 0.1
+    # Share of messages whose sender is missing from the batch entities.
+    unresolved_ratio: float = 0.0
+    seed: int = 0
+
+
+class FakeDialog:
+    def __init__(self, entity: Channel) -> None:
+        self.entity = entity
+        self.id = utils.get_peer_id(entity)
+        self.title = entity.title
+
+
+class FakeMessage:
+    __slots__ = ("id", "date", "action", "sender_id", "sender", "message", "_client")
+
+    def __init__(self, client, message_id, date, action, sender_id, sender, text):
+        self.id = message_id
+        self.date = date
+        self.action = action
+        self.sender_id = sender_id
+        self.sender = sender
+        self.message = text
+        self._client = client
+
+    async def get_sender(self):
+        if self.sender is None:
+            self.sender = await self._client.get_entity(self.sender_id)
+        return self.sender
+
+
+class FakeChat:
+    """Message history of one chat stored as columns, newest message first."""
+
+    def __init__(self, entity: Channel, users: dict[int, User]) -> None:
+        self.entity = entity
+        self.users = users
+        self.ids = array("q")
+        self.dates = array("d")
+        self.sender_ids = array("q")
+        self.actions = array("b")
+        self.text_lens = array("i")
+        self.unresolved = array("b")
+        self.replies = array("b")
+        self.media = array("b")
+
+    def append(
+        self,
+        message_id: int,
+        date: float,
+        sender_id: int,
+        is_action: bool,
+        text_len: int,
+        unresolved: bool = False,
+        is_reply: bool = False,
+        has_media: bool = False,
+    ) -> None:
+        self.ids.append(message_id)
+        self.dates.append(date)
+        self.sender_ids.append(sender_id)
+        self.actions.append(1 if is_action else 0)
+        self.text_lens.append(text_len)
+        self.unresolved.append(1 if unresolved else 0)
+        self.replies.append(1 if is_reply else 0)
+        self.media.append(1 if has_media else 0)
+
+    @classmethod
+    def generate(cls, spec: SyntheticChatSpec, now: datetime) -> FakeChat:
+        rng = random.Random(spec.seed)
+        users: dict[int, User] = {}
+        for index in range(spec.users):
+            user_id = 10_000 + index
+            roll = rng.random()
+            users[user_id] = User(
+                id=user_id,
+                bot=roll < spec.bot_ratio,
+                deleted=spec.bot_ratio <= roll < spec.bot_ratio + spec.deleted_ratio,
+                username=None if rng.random() < spec.no_username_ratio else f"user{user_id}",
+                first_name=f"User {user_id}",
+            )
+
+        chat = cls(Channel(id=spec.chat_id, title=spec.title, photo=None, date=None), users)
+        user_ids = list(users)
+        weights = [1 / (rank + 1) ** spec.sender_skew for rank in range(len(user_ids))]
+        senders = rng.choices(user_ids, weights=weights, k=spec.messages)
+        top = now.timestamp()
+        step = spec.days * 86400 / max(1, spec.messages)
+        # A separate stream keeps senders and dates the same as before the
+        # reply and media flags were added.
+        flags = random.Random(spec.seed + 1)
+        for index, sender_id in enumerate(senders):
+            chat.append(
+                message_id=spec.messages - index,
+                date=top - index * step,
+                sender_id=sender_id,
+                is_action=rng.random() < spec.action_ratio,
+                text_len=rng.randint(0, 200),
+                unresolved=rng.random() < spec.unresolved_ratio,
+                is_reply=flags.random() < spec.reply_ratio,
+                has_media=flags.random() < spec.media_ratio,
+            )
+        return chat
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> FakeChat:
+        """Load a recorded chat.
+
+        The first line describes the chat (``{"chat": {"id": ..., "title": ...}}``),
+        ``{"user": {...}}`` lines describe senders and every other line is a
+        message: ``{"id", "date" (unix seconds), "sender_id", "action",
+        "text_len", "reply", "media"}``. Messages must be ordered newest first.
+        """
+        users: dict[int, User] = {}
+        chat: FakeChat | None = None
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "chat" in record:
+                    info = record["chat"]
+                    entity = Channel(
+                        id=info["id"], title=info.get("title", ""), photo=None, date=None
+                    )
+                    chat = cls(entity, users)
+                elif "user" in record:
+                    info = record["user"]
+                    users[info["id"]] = User(
+                        id=info["id"],
+                        bot=info.get("bot", False),
+                        deleted=info.get("deleted", False),
+                        username=info.get("username"),
+                        first_name=info.get("first_name"),
+                    )
+                else:
+                    if chat is None:
+                        raise ValueError(f"{path}: chat record must come first")
+                    chat.append(
+                        message_id=record["id"],
+                        date=record["date"],
+                        sender_id=record.get("sender_id") or 0,
+                        is_action=record.get("action", False),
+                        text_len=record.get("text_len", 0),
+                        is_reply=record.get("reply", False),
+                        has_media=record.get("media", False),
+                    )
+        if chat is None:
+            raise ValueError(f"{path}: no chat record")
+        return chat
+
+    def to_jsonl(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            chat = {"id": self.entity.id, "title": self.entity.title}
+            file.write(json.dumps({"chat": chat}) + "\n")
+            for user in self.users.values():
+                info = {
+                    "id": user.id,
+                    "bot": bool(user.bot),
+                    "deleted": bool(user.deleted),
+                    "username": user.username,
+                    "first_name": user.first_name,
+                }
+                file.write(json.dumps({"user": info}) + "\n")
+            for index in range(len(self.ids)):
+                message = {
+                    "id": self.ids[index],
+                    "date": self.dates[index],
+                    "sender_id": self.sender_ids[index],
+                    "action": bool(self.actions[index]),
+                    "text_len": self.text_lens[index],
+                    "reply": bool(self.replies[index]),
+                    "media": bool(self.media[index]),
+                }
+                file.write(json.dumps(message) + "\n")
+
+    def start_index(self, offset_date: datetime | None, offset_id: int) -> int:
+        """Index of the first message older than both offsets."""
+        index = 0
+        if offset_id:
+            index = _first_below(self.ids, offset_id)
+        if offset_date is not None:
+            index = max(index, _first_below(self.dates, offset_date.timestamp()))
+        return index
+
+
+def _first_below(column: array, value: float) -> int:
+    # Columns are sorted in descending order.
+    low, high = 0, len(column)
+    while low < high:
+        middle = (low + high) // 2
+        if column[middle] >= value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class FakeTelegramClient:
+    """Offline stand-in for the parts of TelegramClient the parser uses.
+
+    History is served both through ``iter_messages`` and through raw
+    ``GetHistoryRequest`` calls (``await client(request)``).
+    """
+
+    def __init__(
+        self,
+        chats: list[FakeChat],
+        # Raise a FloodWaitError on every N-th history request; 0 disables.
+        flood_wait_every: int = 0,
+        flood_wait_seconds: int = 0,
+        resolve_latency: float = 0.0,
+        # Raise a FloodWaitError when history requests exceed this rate
+        # (token bucket with a one second burst); 0 disables.
+        history_rate_limit: float = 0.0,
+        # Round-trip time of a history request in seconds.
+        history_latency: float = 0.0,
+    ) -> None:
+        self.chats = {chat.entity.id: chat for chat in chats}
+        self.flood_wait_every = flood_wait_every
+        self.flood_wait_seconds = flood_wait_seconds
+        self.resolve_latency = resolve_latency
+        self.history_rate_limit = history_rate_limit
+        self.history_latency = history_latency
+        self._tokens = history_rate_limit
+        self._tokens_at = time.monotonic()
+        self.flood_sleep_threshold = 0
+        self.history_requests = 0
+        self.entity_requests = 0
+        self.flood_waits = 0
+        self.messages_served = 0
+
+    async def __call__(self, request):
+        if not isinstance(request, GetHistoryRequest):
+            raise NotImplementedError(type(request).__name__)
+        self._request_history()
+        if self.history_latency:
+            await asyncio.sleep(self.history_latency)
+        chat = self.chats[request.peer.channel_id]
+        index = chat.start_index(request.offset_date, request.offset_id)
+        end = min(index + min(request.limit, BATCH_SIZE), len(chat.ids))
+        messages = []
+        user_ids = set()
+        for position in range(index, end):
+            if chat.ids[position] <= request.min_id:
+                break
+            messages.append(self._raw_message(chat, position))
+            if not chat.unresolved[position]:
+                user_ids.add(chat.sender_ids[position])
+        users = [chat.users[user_id] for user_id in user_ids if user_id in chat.users]
+        return MessagesSlice(
+            count=len(chat.ids), messages=messages, topics=[], chats=[chat.entity], users=users
+        )
+
+    async def get_input_entity(self, entity):
+        return InputPeerChannel(entity.id, entity.access_hash or 0)
+
+    async def iter_dialogs(self):
+        for chat in self.chats.values():
+            yield FakeDialog(chat.entity)
+
+    async def get_entity(self, entity):
+        self.entity_requests += 1
+        if self.resolve_latency:
+            await asyncio.sleep(self.resolve_latency)
+        user_id = entity if isinstance(entity, int) else getattr(entity, "user_id", None)
+        for chat in self.chats.values():
+            if user_id in chat.users:
+                return chat.users[user_id]
+        raise ValueError(f"Could not find the input entity for {entity!r}")
+
+    async def iter_messages(self, entity, offset_date=None, offset_id=0, min_id=0):
+        chat = self.chats[entity.id]
+        index = chat.start_index(offset_date, offset_id)
+        total = len(chat.ids)
+        while index < total:
+            self._request_history()
+            end = min(index + BATCH_SIZE, total)
+            for position in range(index, end):
+                message_id = chat.ids[position]
+                if message_id <= min_id:
+                    return
+                yield self._message(chat, position)
+            index = end
+
+    def _request_history(self) -> None:
+        self.history_requests += 1
+        if self.flood_wait_every and self.history_requests % self.flood_wait_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+        if self.history_rate_limit:
+            now = time.monotonic()
+            self._tokens = min(
+                self.history_rate_limit,
+                self._tokens + (now - self._tokens_at) * self.history_rate_limit,
+            )
+            self._tokens_at = now
+            if self._tokens < 1:
+                self.flood_waits += 1
+                raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+            self._tokens -= 1
+
+    def _raw_message(self, chat: FakeChat, position: int):
+        self.messages_served += 1
+        peer_id = PeerChannel(chat.entity.id)
+        date = datetime.fromtimestamp(chat.dates[position], tz=timezone.utc)
+        sender_id = chat.sender_ids[position]
+        from_id = PeerUser(sender_id) if sender_id else None
+        if chat.actions[position]:
+            return MessageService(
+                id=chat.ids[position],
+                peer_id=peer_id,
+                date=date,
+                from_id=from_id,
+                action=MessageActionPinMessage(),
+            )
+        return Message(
+            id=chat.ids[position],
+            peer_id=peer_id,
+            date=date,
+            message="x" * chat.text_lens[position],
+            from_id=from_id,
+            reply_to=(
+                MessageReplyHeader(reply_to_msg_id=chat.ids[position] - 1)
+                if chat.replies[position]
+                else None
+            ),
+            media=MessageMediaUnsupported() if chat.media[position] else None,
+        )
+
+    def _message(self, chat: FakeChat, position: int) -> FakeMessage:
+        self.messages_served += 1
+        sender_id = chat.sender_ids[position]
+        sender = None if chat.unresolved[position] else chat.users.get(sender_id)
+        return FakeMessage(
+            self,
+            chat.ids[position],
+            datetime.fromtimestamp(chat.dates[position], tz=timezone.utc),
+            object() if chat.actions[position] else None,
+            sender_id or None,
+            sender,
+            "x" * chat.text_lens[position],
+        )
+
+
+def synthetic_client(specs: list[SyntheticChatSpec], **kwargs) -> FakeTelegramClient:
+    now = datetime.now(timezone.utc) - timedelta(seconds=1)
+    chats = [FakeChat.generate(spec, now) for spec in specs]
+    return FakeTelegramClient(chats, **kwargs)
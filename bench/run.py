@@ -0,0 +1,241 @@
+"""Throughput benchmark for TelegramParser._analyze_chat.
+
+Runs the parser against FakeTelegramClient and a local database and reports
+messages/sec, peak RSS and DB rows written/sec per chat::
+
+    python -m bench.run --messages 200000 --users 20000
+    python -m bench.run --fixture recorded_chat.jsonl --database-url postgresql+asyncpg://...
+
+SQLite needs the ``aiosqlite`` driver.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from bench.fake_client import FakeChat, FakeTelegramClient, SyntheticChatSpec
+from db.session import create_engine, create_sessionmaker, init_db
+from parser.metrics import Metrics
+from parser.profiling import PROFILE_MODES, profile_run
+from parser.ratelimit import RateController
+from parser.service import TelegramParser
+from parser.writer import BatchWriter
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--chats", type=int, default=1)
+    parser.add_argument("--sender-skew", type=float, default=1.1)
+    parser.add_argument("--bot-ratio", type=float, default=0.01)
+    parser.add_argument("--deleted-ratio", type=float, default=0.01)
+    parser.add_argument("--no-username-ratio", type=float, default=0.2)
+    parser.add_argument("--action-ratio", type=float, default=0.01)
+    parser.add_argument("--unresolved-ratio", type=float, default=0.0)
+    parser.add_argument("--flood-wait-every", type=int, default=0)
+    parser.add_argument("--flood-wait-seconds", type=int, default=0)
+    parser.add_argument("--resolve-latency", type=float, default=0.0)
+    parser.add_argument(
+        "--history-rate-limit",
+        type=float,
+        default=0.0,
+        help="simulate a server limit of N history requests per second",
+    )
+    parser.add_argument(
+        "--history-latency",
+        type=float,
+        default=0.0,
+        help="simulated round trip of a history request in seconds",
+    )
+    parser.add_argument("--min-interval", type=float, default=0.0)
+    parser.add_argument("--max-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--fixture",
+        action="append",
+        default=[],
+        help="replay a recorded JSONL chat instead of generating one",
+    )
+    parser.add_argument("--min-messages", type=int, default=100)
+    parser.add_argument(
+        "--window",
+        dest="windows",
+        action="append",
+        type=lambda value: tuple(int(part) for part in value.split(":")),
+        default=[],
+        help="extra profile window as DAYS:MIN_MESSAGES",
+    )
+    parser.add_argument(
+        "--segments", type=int, default=1, help="scan each chat in N parallel time segments"
+    )
+    parser.add_argument("--counter", choices=("exact", "compact", "heavy"), default="exact")
+    parser.add_argument("--heavy-capacity", type=int, default=100_000)
+    parser.add_argument(
+        "--user-stats", action="store_true", help="compute per-user activity details"
+    )
+    parser.add_argument(
+        "--sender-cache-hours",
+        type=int,
+        default=0,
+        help="keep resolved senders in the database for N hours (0 disables)",
+    )
+    parser.add_argument("--leaderboard-size", type=int, default=100)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--profile", choices=PROFILE_MODES, help="dump a profile of the run")
+    parser.add_argument("--profile-dir", default="profiles")
+    parser.add_argument(
+        "--verbose", action="store_true", help="log parser progress and stage timings"
+    )
+    return parser.parse_args()
+
+
+def build_chats(args: argparse.Namespace) -> list[FakeChat]:
+    if args.fixture:
+        return [FakeChat.from_jsonl(path) for path in args.fixture]
+
+    now = datetime.now(timezone.utc)
+    chats = []
+    for index in range(args.chats):
+        spec = SyntheticChatSpec(
+            chat_id=index + 1,
+            title=f"synthetic-{index + 1}",
+            messages=args.messages,
+            users=args.users,
+            days=args.days,
+            sender_skew=args.sender_skew,
+            bot_ratio=args.bot_ratio,
+            deleted_ratio=args.deleted_ratio,
+            no_username_ratio=args.no_username_ratio,
+            action_ratio=args.action_ratio,
+            unresolved_ratio=args.unresolved_ratio,
+            seed=args.seed + index,
+        )
+        chats.append(FakeChat.generate(spec, now))
+    return chats
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    logger = logging.getLogger("bench")
+    chats = build_chats(args)
+    client = FakeTelegramClient(
+        chats,
+        flood_wait_every=args.flood_wait_every,
+        flood_wait_seconds=args.flood_wait_seconds,
+        resolve_latency=args.resolve_latency,
+        history_rate_limit=args.history_rate_limit,
+        history_latency=args.history_latency,
+    )
+
+    metrics = Metrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or (
+            f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        )
+        engine = create_engine(database_url)
+        await init_db(engine)
+        sessionmaker = create_sessionmaker(engine)
+
+        results = []
+        async with BatchWriter(
+            sessionmaker=sessionmaker,
+            batch_size=500,
+            flush_interval=1,
+            metrics=metrics,
+            logger=logger,
+        ) as writer:
+            parser = TelegramParser(
+                client=client,
+                sessionmaker=sessionmaker,
+                writer=writer,
+                target_chat_names=[chat.entity.title for chat in chats],
+                analysis_days=args.days,
+                min_messages=args.min_messages,
+                analysis_windows=args.windows,
+                concurrency=1,
+                segments=args.segments,
+                incremental=False,
+                checkpoint_every=1000,
+                archive=None,
+                counter_mode=args.counter,
+                heavy_capacity=args.heavy_capacity,
+                user_stats=args.user_stats,
+                sender_cache_hours=args.sender_cache_hours,
+                leaderboard_size=args.leaderboard_size,
+                rate=RateController(
+                    min_interval=args.min_interval,
+                    max_interval=args.max_interval,
+                    metrics=metrics,
+                    logger=logger,
+                ),
+                metrics=metrics,
+                logger=logger,
+            )
+            await parser._warm_sender_cache()
+            for chat in chats:
+                served = client.messages_served
+                history = client.history_requests
+                entities = client.entity_requests
+                floods = client.flood_waits
+                rows = writer.rows_written
+
+                started = time.perf_counter()
+                await parser._analyze_chat(chat.entity)
+                scanned = time.perf_counter() - started
+                await writer.flush()
+                elapsed = time.perf_counter() - started
+
+                messages = client.messages_served - served
+                written = writer.rows_written - rows
+                results.append(
+                    {
+                        "chat": chat.entity.title,
+                        "messages": messages,
+                        "seconds": round(elapsed, 3),
+                        "messages_per_sec": round(messages / scanned) if scanned else 0,
+                        "peak_rss_mb": round(peak_rss_mb(), 1),
+                        "db_rows": written,
+                        "db_rows_per_sec": round(written / elapsed) if elapsed else 0,
+                        "history_requests": client.history_requests - history,
+                        "entity_requests": client.entity_requests - entities,
+                        "flood_waits": client.flood_waits - floods,
+                    }
+                )
+        await engine.dispose()
+    return results
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    with profile_run(args.profile, args.profile_dir, logging.getLogger("bench")):
+        results = asyncio.run(run(args))
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                "{chat}: {messages} messages in {seconds}s, {messages_per_sec} msg/s, "
+                "peak RSS {peak_rss_mb} MB, {db_rows} DB rows ({db_rows_per_sec}/s), "
+                "{history_requests} history / {entity_requests} entity requests, "
+                "{flood_waits} flood waits".format(**result)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,19 +16,54 @@ def _get_int(name: str, default: int) -> int:
     return int(value)
 
 
+def _get_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+def _get_windows(name: str) -> list[tuple[int, int]]:
+    """Parse ``days:min_messages`` pairs, e.g. ``1:20,7:100,30:300``."""
+    windows: dict[int, int] = {}
+    for item in (os.getenv(name) or "").split(","):
+        if not item.strip():
+            continue
+        days, _, min_messages = item.partition(":")
+        try:
+            windows[int(days)] = int(min_messages)
+        except ValueError:
+            raise ValueError(f"{name} must look like 1:20,7:100, got {item!r}") from None
+    return sorted(windows.items())
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.lower() in {"1", "true", "yes", "y"}
+
+
 @dataclass(frozen=True)
-class Settings:
-    api_id: int
-    api_hash: str
-    session_name: str
-    target_chat_names: list[str]
+class ArchiveSettings:
+    """What --from-archive needs; it uses neither Telegram nor Postgres."""
+
+    archive_dir: str | None
+    analysis_days: int
+    min_messages: int
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    """What the commands that only read Postgres (export) need."""
+
     postgres_host: str
     postgres_port: int
     postgres_db: str
     postgres_user: str
     postgres_password: str
-    analysis_days: int
-    min_messages: int
+    db_pool_size: int
+    db_statement_cache_size: int
 
     @property
     def database_url(self) -> str:
@@ -38,22 +73,138 @@ class Settings:
         )
 
 
+@dataclass(frozen=True)
+class ReportSettings(DatabaseSettings):
+    """Settings of the report commands, which need no Telegram credentials."""
+
+    analysis_days: int
+    metrics_host: str
+    metrics_port: int
+    reports_host: str
+    reports_port: int
+    reports_cache_ttl: int
+    reports_cache_size: int
+
+
+@dataclass(frozen=True)
+class Settings(ReportSettings):
+    api_id: int
+    api_hash: str
+    session_name: str
+    target_chat_names: list[str]
+    min_messages: int
+    analysis_windows: list[tuple[int, int]]
+    parser_concurrency: int
+    parser_segments: int
+    writer_batch_size: int
+    writer_flush_interval: int
+    parser_incremental: bool
+    checkpoint_every: int
+    archive_dir: str | None
+    parser_counter: str
+    heavy_hitter_capacity: int
+    parser_user_stats: bool
+    sender_cache_ttl_hours: int
+    follow_persist_interval: int
+    schedule_target_messages: int
+    schedule_min_interval: int
+    schedule_max_interval: int
+    schedule_request_budget: int
+    leaderboard_size: int
+    history_min_interval: float
+    history_max_interval: float
+    parser_profile: str | None
+    profile_dir: str
+
+
+def _database_fields() -> dict:
+    return {
+        "postgres_host": _require_env("POSTGRES_HOST"),
+        "postgres_port": _get_int("POSTGRES_PORT", 5432),
+        "postgres_db": _require_env("POSTGRES_DB"),
+        "postgres_user": _require_env("POSTGRES_USER"),
+        "postgres_password": _require_env("POSTGRES_PASSWORD"),
+        "db_pool_size": _get_int("DB_POOL_SIZE", 5),
+        "db_statement_cache_size": _get_int("DB_STATEMENT_CACHE_SIZE", 100),
+    }
+
+
+def _report_fields() -> dict:
+    return {
+        **_database_fields(),
+        "analysis_days": _get_int("ANALYSIS_DAYS", 7),
+        "metrics_host": os.getenv("METRICS_HOST") or "0.0.0.0",
+        "metrics_port": _get_int("METRICS_PORT", 0),
+        "reports_host": os.getenv("REPORTS_HOST") or "127.0.0.1",
+        "reports_port": _get_int("REPORTS_PORT", 8081),
+        "reports_cache_ttl": _get_int("REPORTS_CACHE_TTL", 60),
+        "reports_cache_size": _get_int("REPORTS_CACHE_SIZE", 1024),
+    }
+
+
+def load_archive_settings() -> ArchiveSettings:
+    return ArchiveSettings(
+        archive_dir=os.getenv("ARCHIVE_DIR") or None,
+        analysis_days=_get_int("ANALYSIS_DAYS", 7),
+        min_messages=_get_int("MIN_MESSAGES", 100),
+    )
+
+
+def load_database_settings() -> DatabaseSettings:
+    return DatabaseSettings(**_database_fields())
+
+
+def load_report_settings() -> ReportSettings:
+    return ReportSettings(**_report_fields())
+
+
 def load_settings() -> Settings:
     target_raw = _require_env("TARGET_CHAT_NAMES")
     target_names = [name.strip() for name in target_raw.split(",") if name.strip()]
     if not target_names:
         raise ValueError("TARGET_CHAT_NAMES must contain at least one chat name")
+    parser_concurrency = _get_int("PARSER_CONCURRENCY", 1)
+    if parser_concurrency < 1:
+        raise ValueError("PARSER_CONCURRENCY must be at least 1")
+    parser_segments = _get_int("PARSER_SEGMENTS", 1)
+    if parser_segments < 1:
+        raise ValueError("PARSER_SEGMENTS must be at least 1")
+    parser_counter = (os.getenv("PARSER_COUNTER") or "exact").lower()
+    if parser_counter not in {"exact", "compact", "heavy"}:
+        raise ValueError("PARSER_COUNTER must be one of: exact, compact, heavy")
+    if parser_segments > 1 and parser_counter == "heavy":
+        raise ValueError("PARSER_SEGMENTS above 1 needs PARSER_COUNTER=exact or compact")
+    parser_profile = (os.getenv("PARSER_PROFILE") or "").lower() or None
+    if parser_profile not in {None, "cprofile", "tracemalloc"}:
+        raise ValueError("PARSER_PROFILE must be cprofile or tracemalloc")
 
     return Settings(
+        **_report_fields(),
         api_id=int(_require_env("API_ID")),
         api_hash=_require_env("API_HASH"),
         session_name=_require_env("SESSION_NAME"),
         target_chat_names=target_names,
-        postgres_host=_require_env("POSTGRES_HOST"),
-        postgres_port=_get_int("POSTGRES_PORT", 5432),
-        postgres_db=_require_env("POSTGRES_DB"),
-        postgres_user=_require_env("POSTGRES_USER"),
-        postgres_password=_require_env("POSTGRES_PASSWORD"),
-        analysis_days=_get_int("ANALYSIS_DAYS", 7),
         min_messages=_get_int("MIN_MESSAGES", 100),
+        analysis_windows=_get_windows("ANALYSIS_WINDOWS"),
+        parser_concurrency=parser_concurrency,
+        parser_segments=parser_segments,
+        writer_batch_size=_get_int("WRITER_BATCH_SIZE", 500),
+        writer_flush_interval=_get_int("WRITER_FLUSH_INTERVAL", 2),
+        parser_incremental=_get_bool("PARSER_INCREMENTAL", False),
+        checkpoint_every=_get_int("CHECKPOINT_EVERY", 1000),
+        archive_dir=os.getenv("ARCHIVE_DIR") or None,
+        parser_counter=parser_counter,
+        heavy_hitter_capacity=_get_int("HEAVY_HITTER_CAPACITY", 100000),
+        parser_user_stats=_get_bool("PARSER_USER_STATS", False),
+        sender_cache_ttl_hours=_get_int("SENDER_CACHE_TTL_HOURS", 24),
+        follow_persist_interval=_get_int("FOLLOW_PERSIST_INTERVAL", 30),
+        schedule_target_messages=_get_int("SCHEDULE_TARGET_MESSAGES", 1000),
+        schedule_min_interval=_get_int("SCHEDULE_MIN_INTERVAL", 300),
+        schedule_max_interval=_get_int("SCHEDULE_MAX_INTERVAL", 86400),
+        schedule_request_budget=_get_int("SCHEDULE_REQUEST_BUDGET", 0),
+        leaderboard_size=_get_int("LEADERBOARD_SIZE", 100),
+        history_min_interval=_get_float("HISTORY_MIN_INTERVAL", 0.0),
+        history_max_interval=_get_float("HISTORY_MAX_INTERVAL", 5.0),
+        parser_profile=parser_profile,
+        profile_dir=os.getenv("PROFILE_DIR") or "profiles",
     )
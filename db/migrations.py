@@ -0,0 +1,171 @@
+"""Versioned schema migrations.
+
+Applied versions are recorded in ``schema_version``. A database that is
+already current costs a single version query at startup. New schema changes
+are appended to ``MIGRATIONS`` and never edited once released.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from db.base import Base
+from db.models import ChatLeaderboard, ChatSchedule, SenderCacheEntry
+
+# Arbitrary key for the advisory lock serializing concurrent runners.
+_LOCK_KEY = 7_311_042
+
+
+# Tables of version 1. Tables added later are created by their own
+# migration, so this list never grows.
+_BASELINE_TABLES = (
+    "active_users",
+    "chat_checkpoints",
+    "user_chat_daily_activity",
+    "user_window_activity",
+    "resolved_chats",
+)
+
+
+async def _create_baseline(conn: AsyncConnection) -> None:
+    # Creates whatever is missing, so it also adopts databases that predate
+    # schema_version. Tables that already exist keep their columns; the
+    # column migrations below bring them up to date on every dialect.
+    tables = [Base.metadata.tables[name] for name in _BASELINE_TABLES]
+    await conn.run_sync(Base.metadata.create_all, tables=tables)
+
+
+def _add_columns(table: str, **columns: str):
+    async def apply(conn: AsyncConnection) -> None:
+        # SQLite has no ADD COLUMN IF NOT EXISTS, so existing columns are looked up.
+        existing = await conn.run_sync(
+            lambda sync_conn: {column["name"] for column in inspect(sync_conn).get_columns(table)}
+        )
+        for name, definition in columns.items():
+            if name not in existing:
+                await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+
+    return apply
+
+
+def _execute(*statements: str):
+    async def apply(conn: AsyncConnection) -> None:
+        for statement in statements:
+            await conn.execute(text(statement))
+
+    return apply
+
+
+def _steps(*steps):
+    async def apply(conn: AsyncConnection) -> None:
+        for step in steps:
+            await step(conn)
+
+    return apply
+
+
+MIGRATIONS = (
+    (1, "baseline tables", _create_baseline),
+    (
+        2,
+        "key active_users by user and chat",
+        _steps(
+            _add_columns(
+                "active_users",
+                user_id="BIGINT",
+                chat_id="BIGINT",
+                message_count="INTEGER NOT NULL DEFAULT 0",
+                last_seen="TIMESTAMP WITH TIME ZONE",
+            ),
+            _execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_active_users_user_chat "
+                "ON active_users (user_id, chat_id)",
+                "CREATE INDEX IF NOT EXISTS ix_active_users_username ON active_users (username)",
+                "CREATE INDEX IF NOT EXISTS ix_active_users_created_at "
+                "ON active_users (created_at)",
+            ),
+        ),
+    ),
+    (
+        3,
+        "per-user activity details",
+        _add_columns(
+            "active_users",
+            reply_count="INTEGER",
+            media_count="INTEGER",
+            text_chars="BIGINT",
+            active_days="INTEGER",
+            median_gap_seconds="INTEGER",
+        ),
+    ),
+    (
+        4,
+        "sender cache",
+        lambda conn: conn.run_sync(SenderCacheEntry.__table__.create, checkfirst=True),
+    ),
+    (
+        5,
+        "chat refresh schedule",
+        lambda conn: conn.run_sync(ChatSchedule.__table__.create, checkfirst=True),
+    ),
+    (
+        6,
+        "chat leaderboards",
+        lambda conn: conn.run_sync(ChatLeaderboard.__table__.create, checkfirst=True),
+    ),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def schema_version(engine: AsyncEngine) -> int:
+    """Applied schema version, 0 for a database without ``schema_version``."""
+    async with engine.connect() as conn:
+        return await _read_version(conn)
+
+
+async def _read_version(conn: AsyncConnection) -> int:
+    try:
+        result = await conn.execute(text("SELECT max(version) FROM schema_version"))
+    except DBAPIError:
+        await conn.rollback()
+        return 0
+    return result.scalar() or 0
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    """Apply pending migrations and return the versions applied."""
+    if await schema_version(engine) >= LATEST_VERSION:
+        return []
+
+    applied: list[int] = []
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, "
+                "description VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMP WITH TIME ZONE NOT NULL)"
+            )
+        )
+        if conn.dialect.name == "postgresql":
+            # Several processes may start together; the later one re-reads the version.
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+        current = await _read_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            await apply(conn)
+            await conn.execute(
+                text(
+                    "INSERT INTO schema_version (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {"version": version, "description": description, "applied_at": datetime.utcnow()},
+            )
+            applied.append(version)
+    return applied
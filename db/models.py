@@ -1,6 +1,6 @@
-from datetime import datetime
+from datetime import date, datetime
 
-from sqlalchemy import DateTime, Integer, String
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, Index, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from db.base import Base
@@ -8,10 +8,126 @@ from db.base import Base
 
 class ActiveUser(Base):
     __tablename__ = "active_users"
+    __table_args__ = (
+        Index("uq_active_users_user_chat", "user_id", "chat_id", unique=True),
+        Index("ix_active_users_username", "username"),
+        Index("ix_active_users_created_at", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Null only for rows saved before users were keyed by (user_id, chat_id).
+    # Migrations keep those rows: their chat cannot be recovered, so they are
+    # never matched to keyed rows, and the inviter may still read them.
+    user_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    chat_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     username: Mapped[str] = mapped_column(String(255), nullable=False)
     first_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False, default=datetime.utcnow
     )
+    last_seen: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Activity details of the same window, null until a full scan with
+    # PARSER_USER_STATS computes them.
+    reply_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    media_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    text_chars: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    active_days: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Approximate: estimated from a power-of-two histogram of the gaps.
+    median_gap_seconds: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+
+class ChatCheckpoint(Base):
+    __tablename__ = "chat_checkpoints"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    last_message_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    scan_top_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    offset_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=datetime.utcnow
+    )
+
+
+class UserChatDailyActivity(Base):
+    __tablename__ = "user_chat_daily_activity"
+    __table_args__ = (
+        Index("ix_user_chat_daily_activity_chat_day", "chat_id", "day"),
+    )
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class UserWindowActivity(Base):
+    """Users above a profile window's threshold, rewritten on every scan of the chat."""
+
+    __tablename__ = "user_window_activity"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    window_days: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    computed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=datetime.utcnow
+    )
+
+
+class ChatLeaderboard(Base):
+    """Top users of a chat per window, rewritten at the end of every scan of the chat."""
+
+    __tablename__ = "chat_leaderboard"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    window_days: Mapped[int] = mapped_column(Integer, primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    computed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=datetime.utcnow
+    )
+
+
+class SenderCacheEntry(Base):
+    """Sender fields the parser filters on, kept across runs for ``SENDER_CACHE_TTL_HOURS``."""
+
+    __tablename__ = "sender_cache"
+    __table_args__ = (Index("ix_sender_cache_updated_at", "updated_at"),)
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # False when the session could not resolve the user.
+    found: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+    bot: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    deleted: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    username: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    first_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=datetime.utcnow
+    )
+
+
+class ChatSchedule(Base):
+    """Refresh cadence of a chat in scheduler mode."""
+
+    __tablename__ = "chat_schedule"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # Newest message id seen by the last refresh; 0 until the chat was refreshed once.
+    top_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    messages_per_hour: Mapped[float | None] = mapped_column(Float, nullable=True)
+    last_run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    next_run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class ResolvedChat(Base):
+    __tablename__ = "resolved_chats"
+
+    target: Mapped[str] = mapped_column(String(255), primary_key=True)
+    peer_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    access_hash: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    title: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    resolved_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=datetime.utcnow
+    )
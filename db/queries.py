@@ -0,0 +1,91 @@
+from datetime import date
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import ActiveUser, ChatLeaderboard, UserChatDailyActivity
+
+
+async def window_activity(
+    session: AsyncSession, chat_id: int, since: date, min_messages: int = 0
+) -> dict[int, int]:
+    """Message counts per user in ``chat_id`` from ``since`` (inclusive) onwards.
+
+    Only users with more than ``min_messages`` messages are returned.
+    """
+    total = func.sum(UserChatDailyActivity.message_count)
+    stmt = (
+        select(UserChatDailyActivity.user_id, total)
+        .where(
+            UserChatDailyActivity.chat_id == chat_id,
+            UserChatDailyActivity.day >= since,
+        )
+        .group_by(UserChatDailyActivity.user_id)
+    )
+    if min_messages > 0:
+        stmt = stmt.having(total > min_messages)
+    result = await session.execute(stmt)
+    return {user_id: int(count) for user_id, count in result.all()}
+
+
+async def daily_activity(
+    session: AsyncSession, chat_id: int, since: date
+) -> dict[date, dict[int, int]]:
+    """Message counts per day and user in ``chat_id`` from ``since`` (inclusive) onwards."""
+    result = await session.execute(
+        select(
+            UserChatDailyActivity.day,
+            UserChatDailyActivity.user_id,
+            UserChatDailyActivity.message_count,
+        ).where(
+            UserChatDailyActivity.chat_id == chat_id,
+            UserChatDailyActivity.day >= since,
+        )
+    )
+    days: dict[date, dict[int, int]] = {}
+    for day, user_id, count in result.all():
+        days.setdefault(day, {})[user_id] = count
+    return days
+
+
+async def leaderboard(
+    session: AsyncSession, chat_id: int, window_days: int, limit: int
+) -> list[dict]:
+    """The ``limit`` top users of a chat's leaderboard, with their names when saved."""
+    result = await session.execute(
+        select(
+            ChatLeaderboard.rank,
+            ChatLeaderboard.user_id,
+            ActiveUser.username,
+            ActiveUser.first_name,
+            ChatLeaderboard.message_count,
+            ChatLeaderboard.computed_at,
+        )
+        .outerjoin(
+            ActiveUser,
+            (ActiveUser.user_id == ChatLeaderboard.user_id)
+            & (ActiveUser.chat_id == ChatLeaderboard.chat_id),
+        )
+        .where(
+            ChatLeaderboard.chat_id == chat_id,
+            ChatLeaderboard.window_days == window_days,
+            ChatLeaderboard.rank <= limit,
+        )
+        .order_by(ChatLeaderboard.rank)
+    )
+    return [dict(row) for row in result.mappings()]
+
+
+async def leaderboard_windows(session: AsyncSession) -> list[dict]:
+    """Chats and windows that have a leaderboard, with their size and refresh time."""
+    result = await session.execute(
+        select(
+            ChatLeaderboard.chat_id,
+            ChatLeaderboard.window_days,
+            func.count().label("users"),
+            func.max(ChatLeaderboard.computed_at).label("computed_at"),
+        )
+        .group_by(ChatLeaderboard.chat_id, ChatLeaderboard.window_days)
+        .order_by(ChatLeaderboard.chat_id, ChatLeaderboard.window_days)
+    )
+    return [dict(row) for row in result.mappings()]
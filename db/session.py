@@ -1,29 +1,55 @@
 import asyncio
 
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 
-from db.base import Base
+from db.migrations import migrate
 
 
-def create_engine(database_url: str) -> AsyncEngine:
-    return create_async_engine(database_url, echo=False, future=True)
+def create_engine(
+    database_url: str, pool_size: int = 5, statement_cache_size: int = 100
+) -> AsyncEngine:
+    """Create the async engine.
+
+    ``statement_cache_size`` is passed to asyncpg; 0 disables prepared
+    statement caching, which PgBouncer in transaction mode requires.
+    """
+    kwargs: dict = {}
+    if make_url(database_url).get_backend_name() == "postgresql":
+        kwargs["pool_size"] = pool_size
+        kwargs["connect_args"] = {"statement_cache_size": statement_cache_size}
+    return create_async_engine(database_url, echo=False, future=True, **kwargs)
 
 
 def create_sessionmaker(engine: AsyncEngine) -> async_sessionmaker:
     return async_sessionmaker(bind=engine, expire_on_commit=False)
 
 
-async def init_db(engine: AsyncEngine) -> None:
-    attempts = 30
-    delay = 1
-    last_error: Exception | None = None
-    for _ in range(attempts):
+def upsert_insert(session, table):
+    """INSERT construct supporting ``on_conflict_do_update`` for the session's dialect."""
+    # SQLite is supported so that benchmarks can run without a Postgres server.
+    if session.bind.dialect.name == "sqlite":
+        return sqlite_insert(table)
+    return pg_insert(table)
+
+
+async def init_db(engine: AsyncEngine, timeout: float = 60.0) -> list[int]:
+    """Wait for the database to accept connections, then apply pending migrations.
+
+    Connection attempts back off exponentially from 0.1s to 5s between tries.
+    Returns the migration versions applied.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.1
+    while True:
         try:
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            return
-        except OperationalError as exc:
-            last_error = exc
+            return await migrate(engine)
+        except (OperationalError, OSError) as exc:
+            if loop.time() + delay > deadline:
+                raise RuntimeError("Database is not ready after retries") from exc
             await asyncio.sleep(delay)
-    raise RuntimeError("Database is not ready after retries") from last_error
+            delay = min(delay * 2, 5.0)
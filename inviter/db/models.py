@@ -7,6 +7,9 @@ from db.base import Base
 
 
 class ActiveUser(Base):
+    # Written by the parser, whose versioned migrations own the schema of this
+    # table. Only the columns the inviter reads are mapped, so the inviter
+    # keeps working whatever the parser adds.
     __tablename__ = "active_users"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
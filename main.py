@@ -1,12 +1,34 @@
+import argparse
 import asyncio
+import csv
 import logging
 import os
+import sys
+from datetime import date, datetime, timedelta, timezone
 
+import asyncpg
 from telethon import TelegramClient
 
-from config.settings import load_settings
+from config.settings import (
+    ArchiveSettings,
+    DatabaseSettings,
+    ReportSettings,
+    Settings,
+    load_archive_settings,
+    load_database_settings,
+    load_report_settings,
+    load_settings,
+)
+from db.export import DATASETS, FORMATS, export
 from db.session import create_engine, create_sessionmaker, init_db
+from parser.archive import MessageArchive
+from parser.metrics import Metrics, serve_metrics
+from parser.profiling import profile_run
+from parser.ratelimit import RateController
+from parser.reports import LeaderboardReader, TTLCache, serve_reports
+from parser.scheduler import RequestBudget
 from parser.service import TelegramParser
+from parser.writer import BatchWriter
 
 
 def setup_logging() -> logging.Logger:
@@ -17,27 +39,228 @@ def setup_logging() -> logging.Logger:
     return logging.getLogger("telegram-parser")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telegram active users parser")
+    parser.add_argument(
+        "--from-archive",
+        action="store_true",
+        help="compute activity from ARCHIVE_DIR without connecting to Telegram",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="after the initial scan keep counts current from new messages",
+    )
+    parser.add_argument(
+        "--schedule",
+        action="store_true",
+        help="keep refreshing chats, busy ones more often than quiet ones",
+    )
+    commands = parser.add_subparsers(dest="command")
+    export_parser = commands.add_parser(
+        "export", help="stream parser results from Postgres to a file or stdout"
+    )
+    export_parser.add_argument("dataset", choices=sorted(DATASETS))
+    export_parser.add_argument("--format", choices=FORMATS, default="csv")
+    export_parser.add_argument(
+        "--chat-id", type=int, action="append", default=[], help="repeat for several chats"
+    )
+    export_parser.add_argument("--since", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    export_parser.add_argument("--until", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    export_parser.add_argument("--output", "-o", help="file to write; stdout by default")
+    report_parser = commands.add_parser(
+        "report", help="print a chat leaderboard, or the list of leaderboards"
+    )
+    report_parser.add_argument("--chat-id", type=int, help="list leaderboards when omitted")
+    report_parser.add_argument("--days", type=int, help="window length; ANALYSIS_DAYS by default")
+    report_parser.add_argument("--limit", type=int, default=20)
+    commands.add_parser(
+        "serve-reports", help="serve leaderboards over HTTP at REPORTS_HOST:REPORTS_PORT"
+    )
+    return parser.parse_args()
+
+
+def analyze_archive(settings: ArchiveSettings, logger: logging.Logger) -> None:
+    if not settings.archive_dir:
+        raise ValueError("ARCHIVE_DIR must be set for --from-archive")
+    archive = MessageArchive(settings.archive_dir)
+    date_from = datetime.now(timezone.utc) - timedelta(days=settings.analysis_days)
+
+    output = csv.writer(sys.stdout)
+    output.writerow(["chat_id", "user_id", "messages"])
+    for chat_id in archive.chat_ids():
+        activity = archive.activity(chat_id, date_from, settings.min_messages)
+        logger.info("Archived chat %s: %s active users", chat_id, len(activity))
+        for user_id, count in sorted(activity.items(), key=lambda item: -item[1]):
+            output.writerow([chat_id, user_id, count])
+
+
+async def export_results(
+    settings: DatabaseSettings, args: argparse.Namespace, logger: logging.Logger
+) -> None:
+    connection = await asyncpg.connect(
+        host=settings.postgres_host,
+        port=settings.postgres_port,
+        user=settings.postgres_user,
+        password=settings.postgres_password,
+        database=settings.postgres_db,
+    )
+    try:
+        rows = await export(
+            connection,
+            args.dataset,
+            args.format,
+            args.output or sys.stdout.buffer,
+            chat_ids=args.chat_id,
+            date_from=args.since,
+            date_to=args.until,
+        )
+    finally:
+        await connection.close()
+    logger.info("Exported %s %s rows", rows, args.dataset)
+
+
+def create_report_reader(
+    engine, settings: ReportSettings, metrics: Metrics
+) -> LeaderboardReader:
+    return LeaderboardReader(
+        create_sessionmaker(engine),
+        TTLCache(settings.reports_cache_size, settings.reports_cache_ttl),
+        metrics,
+    )
+
+
+async def print_report(settings: ReportSettings, args: argparse.Namespace) -> None:
+    engine = create_engine(settings.database_url)
+    reader = create_report_reader(engine, settings, Metrics())
+    output = csv.writer(sys.stdout)
+    try:
+        if args.chat_id is None:
+            output.writerow(["chat_id", "window_days", "users", "computed_at"])
+            for row in await reader.windows():
+                output.writerow(row.values())
+            return
+        rows = await reader.top(args.chat_id, args.days or settings.analysis_days, args.limit)
+        output.writerow(["rank", "user_id", "username", "first_name", "messages", "computed_at"])
+        for row in rows:
+            output.writerow(row.values())
+    finally:
+        await engine.dispose()
+
+
+async def serve_report_api(settings: ReportSettings, logger: logging.Logger) -> None:
+    engine = create_engine(
+        settings.database_url,
+        pool_size=settings.db_pool_size,
+        statement_cache_size=settings.db_statement_cache_size,
+    )
+    metrics = Metrics()
+    if settings.metrics_port:
+        await serve_metrics(metrics, settings.metrics_host, settings.metrics_port, logger)
+    server = await serve_reports(
+        create_report_reader(engine, settings, metrics),
+        settings.reports_host,
+        settings.reports_port,
+        logger,
+    )
+    async with server:
+        await server.serve_forever()
+
+
 async def main() -> None:
+    args = parse_args()
     logger = setup_logging()
+    # Commands that do not talk to Telegram only load the settings they use.
+    if args.from_archive:
+        analyze_archive(load_archive_settings(), logger)
+        return
+    if args.command == "export":
+        await export_results(load_database_settings(), args, logger)
+        return
+    if args.command == "report":
+        await print_report(load_report_settings(), args)
+        return
+    if args.command == "serve-reports":
+        await serve_report_api(load_report_settings(), logger)
+        return
     settings = load_settings()
 
+    with profile_run(settings.parser_profile, settings.profile_dir, logger):
+        await run(args, settings, logger)
+
+
+async def run(args: argparse.Namespace, settings: Settings, logger: logging.Logger) -> None:
     os.makedirs("sessions", exist_ok=True)
     session_path = os.path.join("sessions", settings.session_name)
 
-    engine = create_engine(settings.database_url)
-    await init_db(engine)
+    engine = create_engine(
+        settings.database_url,
+        pool_size=settings.db_pool_size,
+        statement_cache_size=settings.db_statement_cache_size,
+    )
+    applied = await init_db(engine)
+    if applied:
+        logger.info("Applied schema migrations: %s", ", ".join(map(str, applied)))
     sessionmaker = create_sessionmaker(engine)
+    metrics = Metrics()
+    if settings.metrics_port:
+        await serve_metrics(metrics, settings.metrics_host, settings.metrics_port, logger)
+    writer = BatchWriter(
+        sessionmaker=sessionmaker,
+        batch_size=settings.writer_batch_size,
+        flush_interval=settings.writer_flush_interval,
+        metrics=metrics,
+        logger=logger,
+    )
 
-    async with TelegramClient(session_path, settings.api_id, settings.api_hash) as client:
+    # Flood waits are handled by the rate controller so that concurrent chats
+    # share one back-off and one request pace.
+    rate = RateController(
+        min_interval=settings.history_min_interval,
+        max_interval=settings.history_max_interval,
+        metrics=metrics,
+        logger=logger,
+    )
+    async with writer, TelegramClient(
+        session_path, settings.api_id, settings.api_hash, flood_sleep_threshold=0
+    ) as client:
         parser = TelegramParser(
             client=client,
             sessionmaker=sessionmaker,
+            writer=writer,
             target_chat_names=settings.target_chat_names,
             analysis_days=settings.analysis_days,
             min_messages=settings.min_messages,
+            analysis_windows=settings.analysis_windows,
+            concurrency=settings.parser_concurrency,
+            segments=settings.parser_segments,
+            incremental=settings.parser_incremental,
+            checkpoint_every=settings.checkpoint_every,
+            archive=MessageArchive(settings.archive_dir) if settings.archive_dir else None,
+            counter_mode=settings.parser_counter,
+            heavy_capacity=settings.heavy_hitter_capacity,
+            user_stats=settings.parser_user_stats,
+            sender_cache_hours=settings.sender_cache_ttl_hours,
+            leaderboard_size=settings.leaderboard_size,
+            rate=rate,
+            metrics=metrics,
             logger=logger,
         )
-        await parser.run()
+        if args.follow:
+            await parser.follow(settings.follow_persist_interval)
+        elif args.schedule:
+            await parser.schedule(
+                target_messages=settings.schedule_target_messages,
+                min_interval=settings.schedule_min_interval,
+                max_interval=settings.schedule_max_interval,
+                budget=(
+                    RequestBudget(settings.schedule_request_budget, rate)
+                    if settings.schedule_request_budget
+                    else None
+                ),
+            )
+        else:
+            await parser.run()
 
 
 if __name__ == "__main__":
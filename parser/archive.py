@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import bisect
+import os
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+# Column name, array typecode and the matching NumPy dtype.
+COLUMNS = (
+    ("id", "q", np.int64),
+    ("sender_id", "q", np.int64),
+    ("date", "q", np.int64),
+    ("action", "b", np.int8),
+    ("text_len", "i", np.int32),
+)
+# Sorted, disjoint (low, high) message id ranges whose messages are all archived.
+COVERED = "covered"
+
+
+class ArchiveAppender:
+    """Buffers message metadata of one chat and appends it to column files.
+
+    Callers report the id ranges they passed in full through ``cover``; the
+    ranges are saved after the rows they describe, and messages inside them
+    are skipped by later appenders of the chat.
+    """
+
+    def __init__(self, path: str, buffer_rows: int = 8192) -> None:
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self._columns = [array(typecode) for _, typecode, _ in COLUMNS]
+        os.makedirs(path, exist_ok=True)
+        self._align_columns()
+        self._covered = _load_covered(path)
+        self._lows = [low for low, _ in self._covered]
+        self._dirty = False
+
+    def append(
+        self,
+        message_id: int,
+        sender_id: int,
+        date: datetime,
+        is_action: bool,
+        text_len: int,
+    ) -> None:
+        index = bisect.bisect_right(self._lows, message_id) - 1
+        if index >= 0 and message_id <= self._covered[index][1]:
+            return
+        ids, senders, dates, actions, text_lens = self._columns
+        ids.append(message_id)
+        senders.append(sender_id)
+        dates.append(int(date.timestamp()))
+        actions.append(1 if is_action else 0)
+        text_lens.append(text_len)
+        if len(ids) >= self.buffer_rows:
+            self.flush()
+
+    def cover(self, low_id: int, high_id: int) -> None:
+        """Record that every message with an id in ``[low_id, high_id]`` was appended."""
+        covered = self._covered
+        index = bisect.bisect_left(self._lows, low_id)
+        # Merge with the overlapping or adjacent ranges on both sides.
+        if index > 0 and covered[index - 1][1] >= low_id - 1:
+            index -= 1
+            low_id = covered[index][0]
+        end = index
+        while end < len(covered) and covered[end][0] <= high_id + 1:
+            high_id = max(high_id, covered[end][1])
+            end += 1
+        covered[index:end] = [(low_id, high_id)]
+        self._lows[index:end] = [low_id]
+        self._dirty = True
+
+    def flush(self) -> None:
+        if self._columns[0]:
+            for (name, typecode, _), column in zip(COLUMNS, self._columns):
+                with open(os.path.join(self.path, name), "ab") as file:
+                    column.tofile(file)
+            self._columns = [array(typecode) for _, typecode, _ in COLUMNS]
+        # Written after the rows, so a range is never saved ahead of its messages.
+        if self._dirty:
+            temp_path = os.path.join(self.path, COVERED + ".tmp")
+            np.array(self._covered, dtype=np.int64).tofile(temp_path)
+            os.replace(temp_path, os.path.join(self.path, COVERED))
+            self._dirty = False
+
+    def _align_columns(self) -> None:
+        # A crash during flush can leave the column files at different
+        # lengths; cut them back to the rows every column has, or later
+        # appends would be out of line.
+        sizes = []
+        for name, _, dtype in COLUMNS:
+            file_path = os.path.join(self.path, name)
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            sizes.append((file_path, size, np.dtype(dtype).itemsize))
+        rows = min(size // itemsize for _, size, itemsize in sizes)
+        for file_path, size, itemsize in sizes:
+            if size > rows * itemsize:
+                os.truncate(file_path, rows * itemsize)
+
+
+class MessageArchive:
+    """Per-chat columnar archive of the message fields the parser uses.
+
+    Every chat is a directory of raw column files that are appended to during
+    scans and memory-mapped for offline analysis. Messages inside the id
+    ranges already archived are not appended again; a scan interrupted
+    before its ranges were saved may still archive a message twice, so
+    readers deduplicate by message id.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def appender(self, chat_id: int) -> ArchiveAppender:
+        return ArchiveAppender(self._chat_path(chat_id))
+
+    def chat_ids(self) -> list[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name)
+            for name in os.listdir(self.directory)
+            if name.lstrip("-").isdigit()
+        )
+
+    def load(self, chat_id: int) -> dict[str, np.ndarray]:
+        """Memory-map the columns of a chat, deduplicated by message id."""
+        path = self._chat_path(chat_id)
+        columns: dict[str, np.ndarray] = {}
+        for name, _, dtype in COLUMNS:
+            file_path = os.path.join(path, name)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                columns[name] = np.empty(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(file_path, dtype=dtype, mode="r")
+
+        # An interrupted flush can leave columns of different lengths.
+        rows = min(len(column) for column in columns.values())
+        _, first = np.unique(columns["id"][:rows], return_index=True)
+        return {name: column[first] for name, column in columns.items()}
+
+    def activity(
+        self, chat_id: int, date_from: datetime, min_messages: int
+    ) -> dict[int, int]:
+        """Count messages per user since ``date_from`` from the archive alone.
+
+        Applies the same filters as the live scan that do not need the sender
+        entity: service messages and non-user senders are skipped.
+        """
+        columns = self.load(chat_id)
+        mask = (
+            (columns["date"] >= int(date_from.timestamp()))
+            & (columns["action"] == 0)
+            & (columns["sender_id"] > 0)
+        )
+        users, counts = np.unique(columns["sender_id"][mask], return_counts=True)
+        active = counts > min_messages
+        return dict(zip(users[active].tolist(), counts[active].tolist()))
+
+    def _chat_path(self, chat_id: int) -> str:
+        return os.path.join(self.directory, str(chat_id))
+
+
+def _load_covered(path: str) -> list[tuple[int, int]]:
+    file_path = os.path.join(path, COVERED)
+    if not os.path.exists(file_path):
+        return []
+    bounds = np.fromfile(file_path, dtype=np.int64).reshape(-1, 2)
+    return [(int(low), int(high)) for low, high in bounds]
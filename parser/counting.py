@@ -0,0 +1,194 @@
+"""Per-sender message counters used by the history scan.
+
+Every counter takes the user senders of one history batch at a time and
+returns ``(user_id, count)`` for the users whose count went above
+``threshold`` in that batch, each of them exactly once.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+class ExactCounter:
+    """Exact counts in a plain dict; fastest, but memory grows with senders."""
+
+    def __init__(self, threshold: int) -> None:
+        self.threshold = threshold
+        self._counts: dict[int, int] = {}
+
+    def seed(self, counts: dict[int, int]) -> None:
+        self._counts.update(counts)
+
+    def add(self, sender_ids: list[int]) -> list[tuple[int, int]]:
+        counts = self._counts
+        crossing = self.threshold + 1
+        crossed = []
+        for sender_id in sender_ids:
+            count = counts.get(sender_id, 0) + 1
+            counts[sender_id] = count
+            if count == crossing:
+                crossed.append((sender_id, count))
+        return crossed
+
+    def items(self):
+        return self._counts.items()
+
+
+class CompactCounter:
+    """Exact counts in sorted NumPy arrays: 12 bytes per distinct sender.
+
+    Senders not seen before are collected in a small dict and merged into the
+    arrays once ``merge_every`` of them are pending.
+    """
+
+    def __init__(self, threshold: int, merge_every: int = 65536) -> None:
+        self.threshold = threshold
+        self.merge_every = merge_every
+        self._ids = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int32)
+        self._pending: dict[int, int] = {}
+
+    def seed(self, counts: dict[int, int]) -> None:
+        self._pending.update(counts)
+        self._merge()
+
+    def add(self, sender_ids: list[int]) -> list[tuple[int, int]]:
+        if not sender_ids:
+            return []
+        threshold = self.threshold
+        ids, batch_counts = np.unique(np.array(sender_ids, dtype=np.int64), return_counts=True)
+        positions = np.searchsorted(self._ids, ids)
+        known = positions < len(self._ids)
+        known[known] = self._ids[positions[known]] == ids[known]
+
+        crossed: list[tuple[int, int]] = []
+        if known.any():
+            at = positions[known]
+            added = batch_counts[known]
+            self._counts[at] += added
+            after = self._counts[at]
+            hit = (after > threshold) & (after - added <= threshold)
+            crossed.extend(zip(ids[known][hit].tolist(), after[hit].tolist()))
+
+        pending = self._pending
+        new = ~known
+        for sender_id, added in zip(ids[new].tolist(), batch_counts[new].tolist()):
+            before = pending.get(sender_id, 0)
+            pending[sender_id] = before + added
+            if before <= threshold < before + added:
+                crossed.append((sender_id, before + added))
+        if len(pending) >= self.merge_every:
+            self._merge()
+        return crossed
+
+    def items(self):
+        self._merge()
+        return zip(self._ids.tolist(), self._counts.tolist())
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        ids = np.fromiter(self._pending.keys(), dtype=np.int64, count=len(self._pending))
+        counts = np.fromiter(self._pending.values(), dtype=np.int32, count=len(self._pending))
+        self._pending = {}
+        ids = np.concatenate([self._ids, ids])
+        counts = np.concatenate([self._counts, counts])
+        order = np.argsort(ids, kind="stable")
+        self._ids = ids[order]
+        self._counts = counts[order]
+
+
+class SpaceSavingCounter:
+    """Heavy-hitter counter (Space-Saving) with a fixed number of slots.
+
+    Tracks at most ``capacity`` senders. A sender's true count lies between
+    ``count - error`` and ``count``; every sender with more than
+    ``total / capacity`` messages is guaranteed to be tracked. A sender is
+    reported once its lower bound exceeds the threshold, so reported users
+    are never false positives, but users close to the threshold may be missed
+    when the capacity is too small for the stream. ``add`` and ``items``
+    report the lower bound, so counts are never overstated either.
+    """
+
+    def __init__(self, threshold: int, capacity: int) -> None:
+        self.threshold = threshold
+        self.capacity = capacity
+        # sender id -> [count, error]
+        self._slots: dict[int, list[int]] = {}
+        # count -> senders with that count; the minimum bucket is evicted from.
+        self._buckets: dict[int, set[int]] = {}
+        self._min_count = 0
+        self._reported: set[int] = set()
+
+    def seed(self, counts: dict[int, int]) -> None:
+        for sender_id, count in counts.items():
+            if count > self.threshold:
+                self._reported.add(sender_id)
+        # Only the largest seeded counts fit; the rest start from zero again.
+        largest = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        for sender_id, count in largest[: self.capacity - len(self._slots)]:
+            if count <= 0 or sender_id in self._slots:
+                continue
+            self._slots[sender_id] = [count, 0]
+            self._buckets.setdefault(count, set()).add(sender_id)
+        if self._buckets:
+            self._min_count = min(self._buckets)
+
+    def add(self, sender_ids: list[int]) -> list[tuple[int, int]]:
+        slots = self._slots
+        threshold = self.threshold
+        crossed = []
+        for sender_id in sender_ids:
+            slot = slots.get(sender_id)
+            if slot is None:
+                slot = self._take_slot(sender_id)
+            else:
+                self._move(sender_id, slot[0], slot[0] + 1)
+                slot[0] += 1
+            count = slot[0] - slot[1]
+            if count > threshold and sender_id not in self._reported:
+                self._reported.add(sender_id)
+                crossed.append((sender_id, count))
+        return crossed
+
+    def items(self):
+        return ((sender_id, count - error) for sender_id, (count, error) in self._slots.items())
+
+    def _take_slot(self, sender_id: int) -> list[int]:
+        if len(self._slots) < self.capacity:
+            slot = [1, 0]
+            self._slots[sender_id] = slot
+            self._buckets.setdefault(1, set()).add(sender_id)
+            self._min_count = 1 if len(self._slots) == 1 else min(self._min_count, 1)
+            return slot
+
+        minimum = self._min_count
+        evicted = self._buckets[minimum].pop()
+        del self._slots[evicted]
+        slot = [minimum + 1, minimum]
+        self._slots[sender_id] = slot
+        self._buckets.setdefault(minimum + 1, set()).add(sender_id)
+        if not self._buckets[minimum]:
+            del self._buckets[minimum]
+            self._min_count = minimum + 1
+        return slot
+
+    def _move(self, sender_id: int, old: int, new: int) -> None:
+        bucket = self._buckets[old]
+        bucket.discard(sender_id)
+        self._buckets.setdefault(new, set()).add(sender_id)
+        if not bucket:
+            del self._buckets[old]
+            if old == self._min_count:
+                self._min_count = new
+
+
+def create_counter(mode: str, threshold: int, heavy_capacity: int):
+    if mode == "exact":
+        return ExactCounter(threshold)
+    if mode == "compact":
+        return CompactCounter(threshold)
+    if mode == "heavy":
+        return SpaceSavingCounter(threshold, heavy_capacity)
+    raise ValueError(f"Unknown counter mode: {mode}")
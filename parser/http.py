@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl, urlsplit
+
+# Handlers get the query string parameters and return the status line,
+# content type and body.
+Handler = Callable[[dict[str, str]], Awaitable[tuple[str, str, bytes]]]
+
+
+async def serve_http(
+    routes: dict[str, Handler], host: str, port: int, logger: logging.Logger
+) -> asyncio.AbstractServer:
+    """Serve ``GET`` requests for ``routes`` over plain HTTP/1.0."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            target = urlsplit(parts[1]) if len(parts) >= 2 and parts[0] == "GET" else None
+            handler = routes.get(target.path) if target is not None else None
+            if handler is None:
+                status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+            else:
+                try:
+                    status, content_type, body = await handler(dict(parse_qsl(target.query)))
+                except Exception:  # noqa: BLE001
+                    logger.exception("Failed to serve %s", target.path)
+                    status, content_type, body = (
+                        "500 Internal Server Error",
+                        "text/plain",
+                        b"internal error\n",
+                    )
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
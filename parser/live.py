@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from datetime import date
+
+from parser.archive import ArchiveAppender
+
+
+class RollingWindow:
+    """Per-user message counts over the calendar days still inside the window."""
+
+    def __init__(self, days: dict[date, dict[int, int]]) -> None:
+        self._days = days
+        self.totals: dict[int, int] = {}
+        for counts in days.values():
+            for user_id, count in counts.items():
+                self.totals[user_id] = self.totals.get(user_id, 0) + count
+
+    def add(self, day: date, user_id: int) -> int:
+        counts = self._days.setdefault(day, {})
+        counts[user_id] = counts.get(user_id, 0) + 1
+        total = self.totals.get(user_id, 0) + 1
+        self.totals[user_id] = total
+        return total
+
+    def expire(self, since: date) -> set[int]:
+        """Drop days before ``since`` and return the users whose totals changed."""
+        changed: set[int] = set()
+        for day in [day for day in self._days if day < since]:
+            for user_id, count in self._days.pop(day).items():
+                total = self.totals[user_id] - count
+                if total > 0:
+                    self.totals[user_id] = total
+                else:
+                    del self.totals[user_id]
+                changed.add(user_id)
+        return changed
+
+
+class LiveChat:
+    """State of one followed chat between persistence rounds."""
+
+    def __init__(
+        self,
+        chat,
+        chat_id: int,
+        window: RollingWindow,
+        last_id: int,
+        appender: ArchiveAppender | None,
+    ) -> None:
+        self.chat = chat
+        self.chat_id = chat_id
+        self.label = str(chat_id)
+        self.window = window
+        # Messages up to this id are already counted.
+        self.last_id = last_id
+        self.saved_id = last_id
+        self.appender = appender
+        # Counts not yet queued for user_chat_daily_activity.
+        self.pending: dict[date, dict[int, int]] = {}
+        # Users whose window count changed since the last persistence round.
+        self.touched: set[int] = set()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+
+class MultiPatternMatcher:
+    """Aho-Corasick matcher that finds substring patterns in one pass over a text.
+
+    ``first_match`` returns the index of the lowest-numbered pattern found in
+    the text, so earlier patterns win when several of them match.
+    """
+
+    def __init__(self, patterns: list[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # Lowest pattern index ending at each node, including through fail links.
+        self._best: list[int | None] = [None]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                node = next_node
+            if self._best[node] is None or index < self._best[node]:
+                self._best[node] = index
+
+        # Breadth-first order guarantees fail targets are complete before use.
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (
+                    self._best[child] is None or inherited < self._best[child]
+                ):
+                    self._best[child] = inherited
+                queue.append(child)
+
+        # The empty pattern matches every text.
+        self._empty = min(
+            (index for index, pattern in enumerate(patterns) if not pattern), default=None
+        )
+
+    def first_match(self, text: str) -> int | None:
+        goto = self._goto
+        fail = self._fail
+        best_at = self._best
+        best = self._empty
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = best_at[node]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+        return best
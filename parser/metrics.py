@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+
+from parser.http import serve_http
+
+# Name: (type, help). Every exported metric has to be declared here.
+METRICS = {
+    "parser_messages_scanned_total": ("counter", "History messages read per chat."),
+    "parser_messages_filtered_total": (
+        "counter",
+        "Messages skipped before counting, by reason.",
+    ),
+    "parser_senders_filtered_total": (
+        "counter",
+        "Senders above the threshold that were not saved, by reason.",
+    ),
+    "parser_live_messages_total": ("counter", "New messages received in follow mode."),
+    "parser_active_users_total": ("counter", "Active users queued for saving per chat."),
+    "parser_sender_resolve_seconds": (
+        "histogram",
+        "Latency of sender lookups that needed a request.",
+    ),
+    "parser_sender_cache_total": (
+        "counter",
+        "Sender lookups answered by the sender cache (hit) or sent on (miss).",
+    ),
+    "parser_report_cache_total": (
+        "counter",
+        "Report reads answered from the cache (hit) or the database (miss).",
+    ),
+    "parser_flood_waits_total": ("counter", "FloodWaitErrors received, by request kind."),
+    "parser_flood_wait_seconds_total": ("counter", "Seconds slept because of flood waits."),
+    "parser_request_interval_seconds": (
+        "gauge",
+        "Current minimum spacing between history requests.",
+    ),
+    "parser_db_flush_seconds": ("histogram", "Latency of batch writer flushes."),
+    "parser_db_rows_written_total": ("counter", "Rows written by the batch writer."),
+    "parser_scan_message_id": ("gauge", "Id of the last message scanned per chat."),
+    "parser_scan_message_timestamp_seconds": (
+        "gauge",
+        "Date of the last message scanned per chat.",
+    ),
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """In-process metric registry rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._values: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        series = self._values.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self._values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram()
+        histogram.observe(value)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in self._values.get(name, {}).items():
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+            for key, histogram in self._histograms.get(name, {}).items():
+                cumulative = 0
+                for bound, count in zip(DEFAULT_BUCKETS, histogram.counts):
+                    cumulative += count
+                    bucket_key = key + (("le", _number(bound)),)
+                    lines.append(f"{name}_bucket{_labels(bucket_key)} {cumulative}")
+                bucket_key = key + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{_labels(bucket_key)} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(key)} {_number(histogram.sum)}")
+                lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in key)
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+async def serve_metrics(
+    metrics: Metrics, host: str, port: int, logger: logging.Logger
+) -> asyncio.AbstractServer:
+    """Serve ``GET /metrics`` over plain HTTP/1.0."""
+
+    async def render(query: dict[str, str]) -> tuple[str, str, bytes]:
+        return "200 OK", "text/plain; version=0.0.4", metrics.render().encode()
+
+    server = await serve_http({"/metrics": render}, host, port, logger)
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return server
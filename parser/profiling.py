@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+# Allocation sites listed in the tracemalloc text report.
+_TOP_ALLOCATIONS = 50
+
+
+class StageTimer:
+    """Wall-clock time and call count per pipeline stage."""
+
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        self._started = time.perf_counter()
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        stages = ", ".join(
+            f"{stage} {seconds:.2f}s/{self.calls[stage]}"
+            for stage, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])
+        )
+        total = time.perf_counter() - self._started
+        return f"{stages or 'no stages'}; total {total:.2f}s"
+
+
+@contextmanager
+def profile_run(mode: str | None, directory: str, logger: logging.Logger):
+    """Profile the enclosed block with cProfile or tracemalloc and dump the result.
+
+    Does nothing when ``mode`` is empty.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"parser-{datetime.now():%Y%m%d-%H%M%S}")
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{base}.prof")
+            logger.info("cProfile stats written to %s.prof", base)
+        return
+
+    tracemalloc.start(25)
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        snapshot.dump(f"{base}.tracemalloc")
+        with open(f"{base}.txt", "w", encoding="utf-8") as report:
+            report.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n")
+            for stat in snapshot.statistics("lineno")[:_TOP_ALLOCATIONS]:
+                report.write(f"{stat}\n")
+        logger.info("tracemalloc snapshot written to %s.tracemalloc and %s.txt", base, base)
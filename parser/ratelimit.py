@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+
+from telethon.errors import FloodWaitError
+
+from parser.metrics import Metrics
+
+
+class RateController:
+    """Client-wide request pacing shared by every chat of a run.
+
+    Paced requests (history pages) are started at most ``limit`` per second
+    across all callers. The limit starts unset (only ``min_interval`` applies)
+    and follows AIMD: a FloodWaitError halves the request rate measured over
+    the last ``window`` paced requests. After that, successful paced requests
+    raise the limit by ``step`` requests per second for every second since
+    the last raise or the end of the last flood wait, an additive increase
+    that does not speed up with the request rate. The rate thus settles
+    just below the server limit instead of running into it again. A flood
+    wait also blocks every request, paced or not, until it expires.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        metrics: Metrics,
+        logger: logging.Logger,
+        step: float = 0.1,
+        window: int = 50,
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.metrics = metrics
+        self.logger = logger
+        self.step = step
+        # Requests per second; None until the first flood wait.
+        self.limit: float | None = None
+        # Loop time the limit was last raised or cut.
+        self._limit_at = 0.0
+        # Paced requests started so far.
+        self.requests = 0
+        self._recent: deque[float] = deque(maxlen=window)
+        # Loop times of the next free paced slot and of the end of the flood wait.
+        self._next_slot = 0.0
+        self._flood_until = 0.0
+
+    @property
+    def interval(self) -> float:
+        if self.limit is None:
+            return self.min_interval
+        return max(self.min_interval, 1 / self.limit)
+
+    async def call(self, method, request, what: str, paced: bool = False):
+        """Await ``method(request)``, retrying after flood waits."""
+        while True:
+            try:
+                if paced:
+                    await self.acquire()
+                else:
+                    await self.wait()
+                result = await method(request)
+            except FloodWaitError as exc:
+                await self.flood_wait(exc, what, paced)
+                continue
+            if paced:
+                self.success()
+            return result
+
+    async def acquire(self) -> None:
+        """Wait for the next paced request slot."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot, self._flood_until)
+        # Reserve the slot before sleeping so concurrent callers queue up behind it.
+        self._next_slot = slot + self.interval
+        self._recent.append(slot)
+        self.requests += 1
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        # The flood wait may have been extended meanwhile.
+        await self.wait()
+
+    async def wait(self) -> None:
+        """Wait until the current flood wait, if any, is over."""
+        delay = self._flood_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def success(self) -> None:
+        if self.limit is not None:
+            now = asyncio.get_running_loop().time()
+            if now > self._limit_at:
+                self.limit += self.step * (now - self._limit_at)
+                self._limit_at = now
+            self.metrics.set("parser_request_interval_seconds", self.interval)
+
+    async def flood_wait(self, exc: FloodWaitError, what: str, paced: bool = False) -> None:
+        loop = asyncio.get_running_loop()
+        wait_time = exc.seconds + 1
+        self._flood_until = max(self._flood_until, loop.time() + wait_time)
+        if paced:
+            self._back_off()
+        # Time spent waiting out the flood is not time without flood waits.
+        self._limit_at = max(self._limit_at, self._flood_until)
+        self.metrics.inc("parser_flood_waits_total", kind=what)
+        self.metrics.inc("parser_flood_wait_seconds_total", wait_time, kind=what)
+        self.logger.warning("Flood wait for %s seconds while %s", wait_time, what)
+        await self.wait()
+
+    def _back_off(self) -> None:
+        recent = self._recent
+        rate = self.limit
+        if len(recent) >= 2 and recent[-1] > recent[0]:
+            measured = (len(recent) - 1) / (recent[-1] - recent[0])
+            rate = measured if rate is None else min(rate, measured)
+        if rate is None:
+            rate = 1 / self.max_interval
+        self.limit = max(rate / 2, 1 / self.max_interval)
+        # Rates measured before the flood wait do not describe the new pace.
+        recent.clear()
+        self.metrics.set("parser_request_interval_seconds", self.interval)
+        self.logger.info("Pacing history requests every %.3fs", self.interval)
@@ -0,0 +1,127 @@
+"""Read-only access to the precomputed chat leaderboards.
+
+Readers go through an in-process LRU cache with a time to live, so repeated
+dashboard reads are answered from memory and each distinct query reaches the
+database at most once per ``ttl`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db.queries import leaderboard, leaderboard_windows
+from parser.http import serve_http
+from parser.metrics import Metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Least recently used entries, each valid for ``ttl`` seconds."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class LeaderboardReader:
+    """Cached leaderboard queries."""
+
+    def __init__(self, sessionmaker, cache: TTLCache, metrics: Metrics) -> None:
+        self.sessionmaker = sessionmaker
+        self.cache = cache
+        self.metrics = metrics
+        # Concurrent misses of the same key share one query.
+        self._pending: dict[tuple, asyncio.Future] = {}
+
+    async def top(self, chat_id: int, window_days: int, limit: int) -> list[dict]:
+        return await self._cached(
+            ("top", chat_id, window_days, limit),
+            lambda session: leaderboard(session, chat_id, window_days, limit),
+        )
+
+    async def windows(self) -> list[dict]:
+        return await self._cached(("windows",), leaderboard_windows)
+
+    async def _cached(self, key: tuple, query) -> list[dict]:
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.metrics.inc("parser_report_cache_total", result="hit")
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        self.metrics.inc("parser_report_cache_total", result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            async with self.sessionmaker() as session:
+                value = await query(session)
+        except Exception as exc:
+            future.set_exception(exc)
+            # Waiters re-raise it; this keeps the loop from reporting it as unretrieved.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._pending[key]
+        self.cache.set(key, value)
+        return value
+
+
+async def serve_reports(
+    reader: LeaderboardReader, host: str, port: int, logger: logging.Logger
+) -> asyncio.AbstractServer:
+    """Serve ``GET /leaderboards`` and ``GET /leaderboard?chat_id=&days=&limit=`` as JSON."""
+
+    async def windows(query: dict[str, str]) -> tuple[str, str, bytes]:
+        return _json("200 OK", await reader.windows())
+
+    async def top(query: dict[str, str]) -> tuple[str, str, bytes]:
+        try:
+            chat_id = int(query["chat_id"])
+            days = int(query["days"])
+            limit = int(query.get("limit", 100))
+        except (KeyError, ValueError):
+            return _json("400 Bad Request", {"error": "chat_id and days are required integers"})
+        return _json("200 OK", await reader.top(chat_id, days, limit))
+
+    server = await serve_http(
+        {"/leaderboards": windows, "/leaderboard": top}, host, port, logger
+    )
+    logger.info("Reports available at http://%s:%s/leaderboards", host, port)
+    return server
+
+
+def _json(status: str, payload) -> tuple[str, str, bytes]:
+    return status, "application/json", json.dumps(payload, default=_encode).encode()
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from db.models import ChatSchedule
+from parser.ratelimit import RateController
+
+# Messages returned by one history request.
+_PAGE = 100
+
+
+class RequestBudget:
+    """Token bucket over the paced requests started through a RateController.
+
+    Refills ``per_hour`` requests an hour, up to one hour's worth. Requests are
+    charged as they are made, so runs that cost more than estimated push the
+    next ones back.
+    """
+
+    def __init__(self, per_hour: float, rate: RateController) -> None:
+        self.capacity = per_hour
+        self.rate = rate
+        self._tokens = per_hour
+        self._seen = rate.requests
+        self._at = 0.0
+
+    def available(self) -> float:
+        now = asyncio.get_running_loop().time()
+        if self._at:
+            refill = (now - self._at) * self.capacity / 3600
+            self._tokens = min(self.capacity, self._tokens + refill)
+        self._at = now
+        self._tokens -= self.rate.requests - self._seen
+        self._seen = self.rate.requests
+        return self._tokens
+
+    async def reserve(self, cost: float) -> None:
+        """Wait until ``cost`` requests fit in the budget."""
+        cost = min(cost, self.capacity)
+        while (missing := cost - self.available()) > 0:
+            await asyncio.sleep(missing * 3600 / self.capacity)
+
+
+class ChatCadence:
+    """Refresh state of one chat in scheduler mode."""
+
+    def __init__(
+        self, chat, chat_id: int, row: ChatSchedule | None, checkpointed: bool, now: datetime
+    ) -> None:
+        self.chat = chat
+        self.chat_id = chat_id
+        # Whether an incremental refresh resumes from a checkpoint instead of
+        # reading the whole analysis window.
+        self.checkpointed = checkpointed
+        if row is None:
+            # Unknown chats are due right away; their rate is learnt from the
+            # next refresh.
+            self.top_id = 0
+            self.messages_per_hour: float | None = None
+            self.last_run = now
+            self.next_run = now
+        else:
+            self.top_id = row.top_id
+            self.messages_per_hour = row.messages_per_hour
+            self.last_run = _utc(row.last_run_at)
+            self.next_run = _utc(row.next_run_at)
+
+    def estimated_requests(self, now: datetime, window: timedelta | None) -> float:
+        """History requests the next refresh is expected to make.
+
+        An incremental refresh reads the messages since the last one; a full
+        one reads ``window``.
+        """
+        if not self.messages_per_hour:
+            return 1
+        span = window or (now - self.last_run)
+        return self.messages_per_hour * span.total_seconds() / 3600 / _PAGE + 1
+
+    def finish(
+        self,
+        top_id: int,
+        messages: int | None,
+        window: timedelta | None,
+        now: datetime,
+        target_messages: int,
+        min_interval: float,
+        max_interval: float,
+    ) -> None:
+        """Update the message rate and plan the next refresh.
+
+        ``messages`` is the number of messages the refresh read, None if it
+        failed. ``window`` is the span the refresh read, or None for an
+        incremental refresh that read what arrived since the last one.
+        Message ids are not used for this, since basic groups share one id
+        sequence across the account. The next refresh is due once about
+        ``target_messages`` new messages are expected.
+        """
+        if window is not None:
+            hours = window.total_seconds() / 3600
+        elif self.top_id:
+            hours = (now - self.last_run).total_seconds() / 3600
+        else:
+            # A checkpoint left by an earlier run covers an unknown span.
+            hours = 0
+        if messages is not None and hours > 0:
+            rate = messages / hours
+            if self.messages_per_hour is None:
+                self.messages_per_hour = rate
+            else:
+                self.messages_per_hour = (self.messages_per_hour + rate) / 2
+        if self.messages_per_hour:
+            interval = target_messages / self.messages_per_hour * 3600
+        else:
+            interval = max_interval if self.top_id else min_interval
+        self.top_id = max(self.top_id, top_id)
+        self.checkpointed = True
+        self.last_run = now
+        self.next_run = now + timedelta(seconds=min(max(interval, min_interval), max_interval))
+
+    def row(self) -> dict:
+        return {
+            "chat_id": self.chat_id,
+            "top_id": self.top_id,
+            "messages_per_hour": self.messages_per_hour,
+            "last_run_at": self.last_run,
+            "next_run_at": self.next_run,
+        }
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite returns stored times without a time zone.
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+
+from telethon.tl.types import User
+
+from db.models import SenderCacheEntry
+
+
+class SenderCache:
+    """Senders by user id, kept for ``ttl`` seconds after they were looked up.
+
+    Entries hold what the parser filters and saves (bot, deleted, username,
+    first_name) as ``User`` objects. ``None`` marks a user the session could
+    not resolve, so the failed lookup is not repeated either.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        # user id -> (expiry as unix time, sender)
+        self._entries: dict[int, tuple[float, User | None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, entries: list[SenderCacheEntry]) -> None:
+        for entry in entries:
+            updated_at = entry.updated_at
+            # SQLite returns the stored UTC time without a time zone.
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            sender = (
+                User(
+                    id=entry.user_id,
+                    bot=entry.bot,
+                    deleted=entry.deleted,
+                    username=entry.username,
+                    first_name=entry.first_name,
+                )
+                if entry.found
+                else None
+            )
+            self._entries[entry.user_id] = (updated_at.timestamp() + self.ttl, sender)
+
+    def get(self, user_id: int) -> tuple[bool, User | None]:
+        """Return whether ``user_id`` has a live entry, and the sender."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires, sender = entry
+        if expires < time.time():
+            del self._entries[user_id]
+            return False, None
+        return True, sender
+
+    def put(self, user_id: int, sender: User | None) -> dict:
+        """Store ``sender`` and return it as a ``sender_cache`` row."""
+        self._entries[user_id] = (time.time() + self.ttl, sender)
+        return {
+            "user_id": user_id,
+            "found": sender is not None,
+            "bot": bool(getattr(sender, "bot", False)),
+            "deleted": bool(getattr(sender, "deleted", False)),
+            "username": getattr(sender, "username", None),
+            "first_name": getattr(sender, "first_name", None),
+            "updated_at": datetime.utcnow(),
+        }
@@ -1,15 +1,111 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
 import logging
-from collections import defaultdict
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import date, datetime, timedelta, timezone
 
-from telethon import TelegramClient
-from telethon.errors import FloodWaitError
-from telethon.tl.types import User
+from sqlalchemy import delete, select
+from telethon import TelegramClient, events, utils
+from telethon.errors import FloodWaitError, RPCError
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import (
+    InputPeerChannel,
+    InputPeerChat,
+    InputPeerUser,
+    MessageEmpty,
+    MessageService,
+    PeerChannel,
+    PeerChat,
+    PeerUser,
+    User,
+)
+from telethon.tl.types.messages import Messages as MessagesMessages
 
-from db.models import ActiveUser
+from db.models import (
+    ChatCheckpoint,
+    ChatSchedule,
+    ResolvedChat,
+    SenderCacheEntry,
+    UserChatDailyActivity,
+)
+from db.queries import daily_activity, window_activity
+from db.session import upsert_insert
+from parser.archive import MessageArchive
+from parser.counting import create_counter
+from parser.live import LiveChat, RollingWindow
+from parser.matching import MultiPatternMatcher
+from parser.metrics import Metrics
+from parser.profiling import StageTimer
+from parser.ratelimit import RateController
+from parser.scheduler import ChatCadence, RequestBudget
+from parser.senders import SenderCache
+from parser.userstats import UserStats
+from parser.writer import BatchWriter
+
+# Scan metrics are published in chunks to keep the per-message cost low.
+_REPORT_EVERY = 1000
+# Largest page GetHistoryRequest returns.
+_HISTORY_LIMIT = 100
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _is_chat_id(name: str) -> bool:
+    return name.lstrip("-").isdigit()
+
+
+def _project_history(messages, date_from: datetime) -> tuple[list[tuple], bool]:
+    """Reduce raw history messages to the fields the scan uses.
+
+    Returns the rows and whether the batch reached ``date_from``.
+    """
+    rows = []
+    for message in messages:
+        if type(message) is MessageEmpty:
+            continue
+        date = message.date
+        if date < date_from:
+            return rows, True
+        from_id = message.from_id
+        if from_id is None:
+            # Private chats carry the sender in peer_id.
+            peer = message.peer_id
+            sender_id = peer.user_id if type(peer) is PeerUser and not message.out else 0
+        elif type(from_id) is PeerUser:
+            sender_id = from_id.user_id
+        else:
+            sender_id = 0
+        text = message.message
+        rows.append(
+            (
+                message.id,
+                date,
+                sender_id,
+                type(message) is MessageService,
+                len(text) if text else 0,
+                message.reply_to is not None,
+                message.media is not None,
+            )
+        )
+    return rows, False
+
+
+def _ceil_second(value: datetime) -> datetime:
+    # Message dates are whole seconds, so ``date >= value`` keeps the same
+    # messages for the rounded bound, which can be sent as an offset_date.
+    if value.microsecond:
+        return value.replace(microsecond=0) + timedelta(seconds=1)
+    return value
+
+
+def _input_peer(peer_id: int, access_hash: int | None):
+    real_id, peer_type = utils.resolve_id(peer_id)
+    if peer_type is PeerChannel:
+        return InputPeerChannel(real_id, access_hash or 0)
+    if peer_type is PeerChat:
+        return InputPeerChat(real_id)
+    return InputPeerUser(real_id, access_hash or 0)
 
 
 class TelegramParser:
@@ -17,16 +113,47 @@ class TelegramParser:
         self,
         client: TelegramClient,
         sessionmaker,
+        writer: BatchWriter,
         target_chat_names: list[str],
         analysis_days: int,
         min_messages: int,
+        analysis_windows: list[tuple[int, int]],
+        concurrency: int,
+        segments: int,
+        incremental: bool,
+        checkpoint_every: int,
+        archive: MessageArchive | None,
+        counter_mode: str,
+        heavy_capacity: int,
+        user_stats: bool,
+        sender_cache_hours: int,
+        leaderboard_size: int,
+        rate: RateController,
+        metrics: Metrics,
         logger: logging.Logger,
     ) -> None:
         self.client = client
         self.sessionmaker = sessionmaker
+        self.writer = writer
         self.target_chat_names = target_chat_names
         self.analysis_days = analysis_days
         self.min_messages = min_messages
+        # (days, min_messages) profiles computed in the same pass.
+        self.analysis_windows = sorted(analysis_windows)
+        self.window_thresholds = dict(self.analysis_windows)
+        self.concurrency = concurrency
+        self.segments = segments
+        self.incremental = incremental
+        self.checkpoint_every = checkpoint_every
+        self.archive = archive
+        self.counter_mode = counter_mode
+        self.heavy_capacity = heavy_capacity
+        self.user_stats = user_stats
+        self.sender_cache_hours = sender_cache_hours
+        self.senders = SenderCache(sender_cache_hours * 3600) if sender_cache_hours > 0 else None
+        self.leaderboard_size = leaderboard_size
+        self.rate = rate
+        self.metrics = metrics
         self.logger = logger
 
     async def run(self) -> None:
@@ -35,97 +162,1007 @@ class TelegramParser:
             self.logger.warning("No target chats found. Nothing to parse.")
             return
 
-        for chat in chats:
-            await self._analyze_chat(chat)
+        await self._warm_sender_cache()
+        await self._analyze_chats(chats)
+
+    async def _analyze_chats(self, chats: list) -> dict[int, int]:
+        """Analyze ``chats`` concurrently; return the newest message id seen per chat."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def analyze(chat) -> int:
+            async with semaphore:
+                top_id, _ = await self._analyze_chat(chat)
+                return top_id
+
+        async with asyncio.TaskGroup() as group:
+            tasks = {utils.get_peer_id(chat): group.create_task(analyze(chat)) for chat in chats}
+        return {chat_id: task.result() for chat_id, task in tasks.items()}
+
+    async def schedule(
+        self,
+        target_messages: int,
+        min_interval: float,
+        max_interval: float,
+        budget: RequestBudget | None,
+    ) -> None:
+        """Keep refreshing the target chats, each on a cadence that follows its message rate.
+
+        A chat is due again once about ``target_messages`` new messages are
+        expected, but not sooner than ``min_interval`` or later than
+        ``max_interval`` seconds. The most overdue chat goes first, at most
+        ``concurrency`` at a time, and only while ``budget`` has room for the
+        requests it is expected to make. Cadences are saved in
+        ``chat_schedule``, so a restart picks up where the last run stopped.
+        """
+        chats = await self._find_target_chats()
+        if not chats:
+            self.logger.warning("No target chats found. Nothing to schedule.")
+            return
+        await self._warm_sender_cache()
+        cadences = await self._load_cadences(chats)
+        # A full refresh reads the longest window, an incremental one only
+        # what is new, or the whole window when the chat has no checkpoint.
+        history = timedelta(
+            days=max([self.analysis_days] + [days for days, _ in self.analysis_windows])
+        )
+        window = None if self.incremental else history
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Set whenever a refresh ends, since its chat may now be due first.
+        finished = asyncio.Event()
+        running: set[int] = set()
+
+        async def refresh(cadence: ChatCadence, span: timedelta | None) -> None:
+            try:
+                top_id, messages = await self._analyze_chat(cadence.chat)
+            except Exception:  # noqa: BLE001
+                self.logger.exception("Refresh of chat %s failed", cadence.chat_id)
+                top_id, messages = 0, None
+            finally:
+                running.discard(cadence.chat_id)
+                semaphore.release()
+                finished.set()
+            cadence.finish(
+                top_id,
+                messages,
+                span,
+                datetime.now(timezone.utc),
+                target_messages,
+                min_interval,
+                max_interval,
+            )
+            self.writer.add_chat_schedule(cadence.row())
+            self.logger.info(
+                "Chat %s refreshed at %.1f messages/hour, next refresh at %s",
+                cadence.chat_id,
+                cadence.messages_per_hour or 0,
+                cadence.next_run.isoformat(timespec="seconds"),
+            )
+
+        async with asyncio.TaskGroup() as group:
+            while True:
+                idle = [cadence for cadence in cadences if cadence.chat_id not in running]
+                finished.clear()
+                if not idle:
+                    await finished.wait()
+                    continue
+                cadence = min(idle, key=lambda item: item.next_run)
+                now = datetime.now(timezone.utc)
+                delay = (cadence.next_run - now).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(finished.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                span = window if cadence.checkpointed else history
+                await semaphore.acquire()
+                if budget is not None:
+                    await budget.reserve(cadence.estimated_requests(now, span))
+                running.add(cadence.chat_id)
+                group.create_task(refresh(cadence, span))
+
+    async def _load_cadences(self, chats: list) -> list[ChatCadence]:
+        chat_ids = {utils.get_peer_id(chat): chat for chat in chats}
+        async with self.sessionmaker() as session:
+            result = await session.execute(
+                select(ChatSchedule).where(ChatSchedule.chat_id.in_(list(chat_ids)))
+            )
+            rows = {row.chat_id: row for row in result.scalars()}
+            result = await session.execute(
+                select(ChatCheckpoint.chat_id).where(ChatCheckpoint.chat_id.in_(list(chat_ids)))
+            )
+            checkpointed = set(result.scalars())
+        now = datetime.now(timezone.utc)
+        return [
+            ChatCadence(chat, chat_id, rows.get(chat_id), chat_id in checkpointed, now)
+            for chat_id, chat in chat_ids.items()
+        ]
+
+    async def follow(self, persist_interval: float) -> None:
+        """Backfill the target chats, then keep their counts current from new messages.
+
+        New messages are queued from the moment the handler is registered and
+        applied once the backfill is done; those the backfill already counted
+        are skipped by id. Counts, promotions and checkpoints are persisted
+        every ``persist_interval`` seconds and on shutdown.
+        """
+        chats = await self._find_target_chats()
+        if not chats:
+            self.logger.warning("No target chats found. Nothing to follow.")
+            return
+        await self._warm_sender_cache()
+
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def on_message(event) -> None:
+            queue.put_nowait(event.message)
+
+        builder = events.NewMessage(chats=[utils.get_peer_id(chat) for chat in chats])
+        self.client.add_event_handler(on_message, builder)
+        try:
+            top_ids = await self._analyze_chats(chats)
+            await self.writer.flush()
+            live = await self._load_live_chats(chats, top_ids)
+            self.logger.info("Following %s chats", len(live))
+
+            tasks = {
+                asyncio.create_task(self._consume_live(queue, live)),
+                asyncio.create_task(self._persist_live_every(live, persist_interval)),
+                asyncio.ensure_future(self.client.run_until_disconnected()),
+            }
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # The consumer and the persister only stop by raising; their
+                # error ends the run instead of leaving a client that no
+                # longer counts or persists.
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self._persist_live(live)
+        finally:
+            self.client.remove_event_handler(on_message, builder)
+
+    async def _load_live_chats(self, chats: list, top_ids: dict[int, int]) -> dict[int, LiveChat]:
+        since = self._window_start().date()
+        live: dict[int, LiveChat] = {}
+        async with self.sessionmaker() as session:
+            for chat in chats:
+                chat_id = utils.get_peer_id(chat)
+                window = RollingWindow(await daily_activity(session, chat_id, since))
+                appender = self.archive.appender(chat_id) if self.archive is not None else None
+                live[chat_id] = LiveChat(chat, chat_id, window, top_ids[chat_id], appender)
+        return live
+
+    async def _consume_live(self, queue: asyncio.Queue, live: dict[int, LiveChat]) -> None:
+        while True:
+            message = await queue.get()
+            state = live.get(utils.get_peer_id(message.peer_id))
+            if state is None or message.id <= state.last_id:
+                continue
+            state.last_id = message.id
+            rows, _ = _project_history([message], _EPOCH)
+            for message_id, message_date, sender_id, is_action, text_len, _, _ in rows:
+                self.metrics.inc("parser_live_messages_total", chat=state.label)
+                if state.appender is not None:
+                    state.appender.append(message_id, sender_id, message_date, is_action, text_len)
+                    state.appender.cover(message_id, message_id)
+                if is_action or not sender_id:
+                    continue
+                day = message_date.date()
+                pending = state.pending.setdefault(day, {})
+                pending[sender_id] = pending.get(sender_id, 0) + 1
+                count = state.window.add(day, sender_id)
+                state.touched.add(sender_id)
+                # Users can drop out of the window and cross again later; the
+                # active_users upsert makes repeated promotions harmless.
+                if count == self.min_messages + 1:
+                    sender = getattr(message, "sender", None) or await self._resolve_user(
+                        sender_id
+                    )
+                    self._save_active_user(
+                        state.chat, state.chat_id, state.label, sender_id, sender, count
+                    )
+
+    async def _persist_live_every(self, live: dict[int, LiveChat], interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self._persist_live(live)
+
+    def _persist_live(self, live: dict[int, LiveChat]) -> None:
+        since = self._window_start().date()
+        threshold = self.min_messages
+        for state in live.values():
+            if state.appender is not None:
+                state.appender.flush()
+
+            expired = state.window.expire(since)
+            totals = state.window.totals
+            changed = {
+                user_id: totals.get(user_id, 0)
+                for user_id in state.touched
+                if totals.get(user_id, 0) > threshold
+            }
+            # Saved users that fell out of the window get their lower count too.
+            changed.update((user_id, totals.get(user_id, 0)) for user_id in expired)
+            if changed:
+                self.writer.add_user_counts(state.chat_id, changed)
+            state.touched = set()
+
+            if state.last_id != state.saved_id:
+                # New messages are counted with the checkpoint that covers them.
+                self.writer.add_checkpoint(
+                    state.chat_id, state.last_id, None, None, state.pending
+                )
+                state.saved_id = state.last_id
+            state.pending = {}
+
+    def _window_start(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(days=self.analysis_days)
 
     async def _find_target_chats(self) -> list:
-        targets = [name.lower() for name in self.target_chat_names]
+        started = time.perf_counter()
         found: dict[str, object] = {}
-        async for dialog in self._iter_dialogs_with_floodwait():
-            title = (dialog.title or "").strip()
-            title_key = title.lower()
-            for target in targets:
-                if target in title_key:
-                    if target not in found:
-                        found[target] = dialog.entity
-                    break
+        cached = await self._load_resolved_chats()
+        for name in self.target_chat_names:
+            row = cached.get(name)
+            if row is not None:
+                reference = _input_peer(row.peer_id, row.access_hash)
+            elif name.startswith("@") or _is_chat_id(name):
+                reference = int(name) if _is_chat_id(name) else name
+            else:
+                continue
+            entity = await self._get_entity(reference)
+            if entity is not None:
+                found[name] = entity
+            elif row is not None:
+                self.logger.warning("Cached chat '%s' is no longer accessible", name)
+
+        remaining = [name for name in self.target_chat_names if name not in found]
+        if remaining:
+            found.update(await self._scan_dialogs(remaining))
 
-        missing = [name for name in self.target_chat_names if name.lower() not in found]
+        missing = [name for name in self.target_chat_names if name not in found]
         if missing:
             self.logger.warning("Chats not found: %s", ", ".join(missing))
-        self.logger.info("Found %s chats", len(found))
-        return list(found.values())
+        await self._store_resolved_chats(
+            {
+                name: entity
+                for name, entity in found.items()
+                if name not in cached or cached[name].peer_id != utils.get_peer_id(entity)
+            }
+        )
+
+        chats: dict[int, object] = {}
+        for name in self.target_chat_names:
+            if name in found:
+                chats.setdefault(utils.get_peer_id(found[name]), found[name])
+        self.logger.info("Found %s chats in %.2fs", len(chats), time.perf_counter() - started)
+        return list(chats.values())
 
-    async def _analyze_chat(self, chat) -> None:
+    async def _scan_dialogs(self, names: list[str]) -> dict[str, object]:
+        """Match ``names`` against dialog titles (or ids) in a single pass."""
+        ids = {int(name): name for name in names if _is_chat_id(name)}
+        titles = [name for name in names if name not in ids.values()]
+        matcher = MultiPatternMatcher([name.lower() for name in titles])
+        found: dict[str, object] = {}
+        async for dialog in self._iter_dialogs_with_floodwait():
+            name = ids.get(dialog.id)
+            if name is None:
+                index = matcher.first_match((dialog.title or "").strip().lower())
+                if index is None:
+                    continue
+                name = titles[index]
+            if name not in found:
+                found[name] = dialog.entity
+                if len(found) == len(names):
+                    break
+        return found
+
+    async def _load_resolved_chats(self) -> dict[str, ResolvedChat]:
+        async with self.sessionmaker() as session:
+            result = await session.execute(
+                select(ResolvedChat).where(ResolvedChat.target.in_(self.target_chat_names))
+            )
+            return {row.target: row for row in result.scalars()}
+
+    async def _store_resolved_chats(self, entities: dict[str, object]) -> None:
+        if not entities:
+            return
+        rows = [
+            {
+                "target": name,
+                "peer_id": utils.get_peer_id(entity),
+                "access_hash": getattr(entity, "access_hash", None),
+                "title": getattr(entity, "title", None),
+                "resolved_at": datetime.utcnow(),
+            }
+            for name, entity in entities.items()
+        ]
+        async with self.sessionmaker() as session:
+            stmt = upsert_insert(session, ResolvedChat).values(rows)
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ResolvedChat.target],
+                    set_={
+                        "peer_id": stmt.excluded.peer_id,
+                        "access_hash": stmt.excluded.access_hash,
+                        "title": stmt.excluded.title,
+                        "resolved_at": stmt.excluded.resolved_at,
+                    },
+                )
+            )
+            await session.commit()
+
+    async def _get_entity(self, reference):
+        while True:
+            try:
+                await self.rate.wait()
+                return await self.client.get_entity(reference)
+            except FloodWaitError as exc:
+                await self.rate.flood_wait(exc, "entities")
+            except (ValueError, RPCError) as exc:
+                self.logger.warning("Could not resolve chat %s: %s", reference, exc)
+                return None
+
+    async def _analyze_chat(self, chat) -> tuple[int, int]:
+        """Scan ``chat``; return the newest message id seen and the messages read."""
+        # Space-Saving counts of separate segments only add up to upper
+        # bounds, which would promote false positives; heavy mode scans
+        # sequentially.
+        if self.segments > 1 and not self.incremental and self.counter_mode != "heavy":
+            return await self._analyze_chat_segmented(chat)
         date_to = datetime.now(timezone.utc)
-        date_from = date_to - timedelta(days=self.analysis_days)
-        counts: dict[int, int] = defaultdict(int)
-        users: dict[int, User] = {}
+        primary_from = date_to - timedelta(days=self.analysis_days)
+        # One pass reaches back to the largest window; smaller windows are
+        # snapshots of the cumulative counts taken when the scan crosses
+        # their start.
+        date_from = min(
+            [primary_from]
+            + [date_to - timedelta(days=days) for days, _ in self.analysis_windows]
+        )
+        counter = create_counter(self.counter_mode, self.min_messages, self.heavy_capacity)
         saved_user_ids: set[int] = set()
+        timer = StageTimer()
 
         self.logger.info("Analyzing chat: %s", getattr(chat, "title", str(chat)))
-        async with self.sessionmaker() as session:
-            async for message in self._iter_messages_with_floodwait(chat, date_to):
-                if message.date < date_from:
-                    break
-                if message.action is not None:
-                    continue
-                sender = await message.get_sender()
-                if not isinstance(sender, User):
-                    continue
-                if sender.bot or sender.deleted:
+        chat_id = utils.get_peer_id(chat)
+        incremental = self.incremental
+        checkpoint_every = self.checkpoint_every
+        min_id = 0
+        offset_id = 0
+        scan_top_id: int | None = None
+        if incremental:
+            with timer.span("db"):
+                checkpoint, counts = await self._load_incremental_state(
+                    chat_id, primary_from.date()
+                )
+            # Users already above the threshold were promoted by earlier runs.
+            counter.seed(counts)
+            if checkpoint is not None:
+                min_id = checkpoint.last_message_id
+                if checkpoint.offset_id:
+                    offset_id = checkpoint.offset_id
+                    scan_top_id = checkpoint.scan_top_id
+                    self.logger.info(
+                        "Resuming chat '%s' from message %s",
+                        getattr(chat, "title", ""),
+                        offset_id,
+                    )
+        since_checkpoint = 0
+        # Messages arrive newest first, so per-day counts are kept for one day
+        # at a time and queued when the scan crosses into the previous day.
+        # Incremental counts are added to the stored ones, so they are held
+        # back and queued with the checkpoint covering them: counts committed
+        # ahead of the saved offset would be added again on resume.
+        day: date | None = None
+        day_start = datetime.max.replace(tzinfo=timezone.utc)
+        day_counts: dict[int, int] = {}
+        pending_days: dict[date, dict[int, int]] = {}
+        appender = self.archive.appender(chat_id) if self.archive is not None else None
+        # Details of new messages alone would replace the full-window ones, so
+        # they are only computed by full scans.
+        stats = UserStats(primary_from) if self.user_stats and not incremental else None
+        chat_label = str(chat_id)
+        scanned = 0
+        skipped_actions = 0
+        skipped_senders = 0
+
+        # Window starts, newest first. None stands for the ANALYSIS_DAYS window
+        # that drives promotion; an incremental scan only sees new messages,
+        # so its profile windows are read from the daily counts instead.
+        cutoffs: list[tuple[datetime, int | None]] = [(primary_from, None)]
+        if not incremental:
+            cutoffs += [
+                (date_to - timedelta(days=days), days) for days, _ in self.analysis_windows
+            ]
+        cutoffs.sort(key=lambda cutoff: cutoff[0], reverse=True)
+        cutoff_index = 0
+        next_cutoff = cutoffs[0][0]
+        promoting = True
+        user_counts: dict[int, int] = {}
+        profiles: dict[int, dict[int, int]] = {}
+
+        def take_snapshot(days: int | None) -> None:
+            nonlocal promoting, user_counts
+            if days is None:
+                promoting = False
+                threshold = self.min_messages
+            else:
+                threshold = self.window_thresholds[days]
+            snapshot = {
+                user_id: count for user_id, count in counter.items() if count > threshold
+            }
+            if days is None:
+                user_counts = snapshot
+            else:
+                profiles[days] = snapshot
+
+        message_id = 0
+        message_date = date_to
+        top_id = max(scan_top_id or 0, min_id)
+        read = 0
+        # Newest message passed to the archive by this scan.
+        archived_from: int | None = None
+        senders: list[int] = []
+        users: dict[int, User] = {}
+
+        async def count_senders() -> None:
+            nonlocal senders
+            with timer.span("count"):
+                crossed = counter.add(senders)
+            senders = []
+            if not promoting:
+                return
+            # Senders are only looked at once, in the batch where they cross
+            # the threshold, so their entity is still in ``users``.
+            for sender_id, count in crossed:
+                sender = users.get(sender_id)
+                if sender is None:
+                    with timer.span("resolve"):
+                        sender = await self._resolve_user(sender_id)
+                else:
+                    self._remember_sender(sender_id, sender)
+                if self._save_active_user(chat, chat_id, chat_label, sender_id, sender, count):
+                    saved_user_ids.add(sender_id)
+
+        async for rows, users in self._iter_history(
+            chat, date_from, date_to, timer, offset_id=offset_id, min_id=min_id
+        ):
+            if stats is not None:
+                with timer.span("stats"):
+                    stats.extend(rows)
+            batch_started = time.perf_counter()
+            if not incremental and not read:
+                # Queued ahead of the daily rows this scan writes, so a later
+                # incremental run starts above them instead of adding them again.
+                self.writer.add_checkpoint(chat_id, rows[0][0], None, None)
+            top_id = max(top_id, rows[0][0])
+            read += len(rows)
+            for message_id, message_date, sender_id, is_action, text_len, _, _ in rows:
+                scanned += 1
+                if scanned >= _REPORT_EVERY:
+                    self._report_scan(
+                        chat_label,
+                        scanned,
+                        skipped_actions,
+                        skipped_senders,
+                        message_id,
+                        message_date,
+                    )
+                    scanned = skipped_actions = skipped_senders = 0
+                if message_date < day_start:
+                    if day_counts:
+                        if incremental:
+                            pending_days[day] = day_counts
+                        else:
+                            self.writer.add_daily_activity(chat_id, day, day_counts, False)
+                        day_counts = {}
+                    day = message_date.date()
+                    day_start = datetime.combine(
+                        day, datetime.min.time(), tzinfo=timezone.utc
+                    )
+                while message_date < next_cutoff:
+                    await count_senders()
+                    take_snapshot(cutoffs[cutoff_index][1])
+                    cutoff_index += 1
+                    next_cutoff = (
+                        cutoffs[cutoff_index][0] if cutoff_index < len(cutoffs) else _EPOCH
+                    )
+                if appender is not None:
+                    appender.append(message_id, sender_id, message_date, is_action, text_len)
+                if is_action:
+                    skipped_actions += 1
                     continue
-                if not sender.username:
+                # Channels and anonymous admins are not users.
+                if not sender_id:
+                    skipped_senders += 1
                     continue
 
-                counts[sender.id] += 1
-                users[sender.id] = sender
+                day_counts[sender_id] = day_counts.get(sender_id, 0) + 1
+                senders.append(sender_id)
+            timer.add("scan", time.perf_counter() - batch_started)
+            if appender is not None:
+                archived_from = archived_from or rows[0][0]
+                appender.cover(rows[-1][0], archived_from)
 
-                if counts[sender.id] > self.min_messages and sender.id not in saved_user_ids:
-                    saved_user_ids.add(sender.id)
-                    username = f"@{sender.username}"
-                    session.add(
-                        ActiveUser(
-                            username=username,
-                            first_name=sender.first_name,
-                        )
-                    )
-                    await session.commit()
-                    self.logger.info(
-                        "Saved active user %s (%s) in chat '%s'",
-                        sender.first_name,
-                        username,
-                        getattr(chat, "title", ""),
+            await count_senders()
+
+            if incremental:
+                if scan_top_id is None:
+                    scan_top_id = rows[0][0]
+                since_checkpoint += len(rows)
+                # Checkpoints are taken between batches, after the batch's
+                # promotions, and point at the last fully processed message.
+                if since_checkpoint >= checkpoint_every:
+                    if day_counts:
+                        pending_days[day] = day_counts
+                        day_counts = {}
+                    if appender is not None:
+                        appender.flush()
+                    self.writer.add_checkpoint(
+                        chat_id, min_id, scan_top_id, rows[-1][0], pending_days
                     )
+                    pending_days = {}
+                    since_checkpoint = 0
+
+        if scanned:
+            self._report_scan(
+                chat_label,
+                scanned,
+                skipped_actions,
+                skipped_senders,
+                message_id,
+                message_date,
+            )
+        # Windows reaching past the start of the history hold every message.
+        for _, days in cutoffs[cutoff_index:]:
+            take_snapshot(days)
+        if day_counts:
+            if incremental:
+                pending_days[day] = day_counts
+            else:
+                self.writer.add_daily_activity(chat_id, day, day_counts, False)
+        if appender is not None:
+            appender.flush()
+        # Refresh the window counts of saved users, including those promoted
+        # by earlier runs.
+        self.writer.add_user_counts(chat_id, user_counts)
+        if stats is not None:
+            with timer.span("stats"):
+                self.writer.add_user_stats(chat_id, stats.rows(user_counts))
+        if incremental:
+            self.writer.add_checkpoint(
+                chat_id, max(scan_top_id or 0, min_id), None, None, pending_days
+            )
+        if self.analysis_windows:
+            if incremental:
+                with timer.span("db"):
+                    profiles = await self._load_window_profiles(chat_id, date_to)
+            self._store_window_profiles(chat, chat_id, profiles)
+        self._store_leaderboards(chat_id, user_counts, profiles)
 
         self.logger.info(
-            "Active users saved in chat '%s': %s",
+            "Active users found in chat '%s': %s",
             getattr(chat, "title", ""),
             len(saved_user_ids),
         )
+        self.logger.info(
+            "Stage timings for chat '%s': %s", getattr(chat, "title", ""), timer.summary()
+        )
+        return top_id, read
+
+    async def _analyze_chat_segmented(self, chat) -> tuple[int, int]:
+        """Full scan of ``chat`` split into time segments read concurrently.
+
+        Every window start is also a segment boundary, so each window is a
+        union of whole segments. Segment counts are merged exactly before
+        anyone is promoted, which saves the same users, counts and profiles
+        as a sequential scan.
+        """
+        date_to = datetime.now(timezone.utc)
+        primary_from = date_to - timedelta(days=self.analysis_days)
+        window_starts: dict[datetime, list[int | None]] = {}
+        window_starts.setdefault(_ceil_second(primary_from), []).append(None)
+        for days, _ in self.analysis_windows:
+            window_starts.setdefault(_ceil_second(date_to - timedelta(days=days)), []).append(
+                days
+            )
+        date_from = min(window_starts)
+        span = (date_to - date_from) / self.segments
+        boundaries = set(window_starts)
+        boundaries.update(
+            _ceil_second(date_from + span * index) for index in range(1, self.segments)
+        )
+        # Newest first; segment i covers [starts[i], ends[i]).
+        starts = sorted((start for start in boundaries if start < date_to), reverse=True)
+        ends = [date_to] + starts[:-1]
+
+        chat_id = utils.get_peer_id(chat)
+        chat_label = str(chat_id)
+        title = getattr(chat, "title", "")
+        timer = StageTimer()
+        appender = self.archive.appender(chat_id) if self.archive is not None else None
+        # A user above MIN_MESSAGES overall is above this in at least one
+        # segment, and is among the senders of the batch where it got there.
+        segment_threshold = self.min_messages // len(starts)
+        self.logger.info("Analyzing chat: %s in %s segments", title, len(starts))
+        # Set once the newest segment has queued the chat checkpoint; the other
+        # segments wait for it before queueing daily rows, like a sequential
+        # full scan.
+        checkpointed = asyncio.Event()
+
+        async def scan(start: datetime, end: datetime):
+            newest = end == date_to
+            counter = create_counter(self.counter_mode, segment_threshold, self.heavy_capacity)
+            stats = UserStats(primary_from) if self.user_stats else None
+            entities: dict[int, User] = {}
+            # The newest and oldest day can continue in the neighbouring
+            # segments; their counts are merged before they are queued.
+            edge_days: dict[date, dict[int, int]] = {}
+            first_day: date | None = None
+            day: date | None = None
+            day_start = datetime.max.replace(tzinfo=timezone.utc)
+            day_counts: dict[int, int] = {}
+            top_id = read = 0
+            scanned = skipped_actions = skipped_senders = 0
+            message_id = 0
+            message_date = end
+            archived_from: int | None = None
+            async for rows, users in self._iter_history(chat, start, end, timer):
+                if stats is not None:
+                    with timer.span("stats"):
+                        stats.extend(rows)
+                if newest and not checkpointed.is_set():
+                    self.writer.add_checkpoint(chat_id, rows[0][0], None, None)
+                    checkpointed.set()
+                elif not newest:
+                    await checkpointed.wait()
+                batch_started = time.perf_counter()
+                top_id = max(top_id, rows[0][0])
+                read += len(rows)
+                senders = []
+                for message_id, message_date, sender_id, is_action, text_len, _, _ in rows:
+                    scanned += 1
+                    if scanned >= _REPORT_EVERY:
+                        self._report_scan(
+                            chat_label,
+                            scanned,
+                            skipped_actions,
+                            skipped_senders,
+                            message_id,
+                            message_date,
+                        )
+                        scanned = skipped_actions = skipped_senders = 0
+                    if message_date < day_start:
+                        if day_counts:
+                            if day == first_day:
+                                edge_days[day] = day_counts
+                            else:
+                                self.writer.add_daily_activity(chat_id, day, day_counts, False)
+                            day_counts = {}
+                        day = message_date.date()
+                        first_day = first_day or day
+                        day_start = datetime.combine(
+                            day, datetime.min.time(), tzinfo=timezone.utc
+                        )
+                    if appender is not None:
+                        appender.append(message_id, sender_id, message_date, is_action, text_len)
+                    if is_action:
+                        skipped_actions += 1
+                        continue
+                    if not sender_id:
+                        skipped_senders += 1
+                        continue
+                    day_counts[sender_id] = day_counts.get(sender_id, 0) + 1
+                    senders.append(sender_id)
+                timer.add("scan", time.perf_counter() - batch_started)
+                if appender is not None:
+                    archived_from = archived_from or rows[0][0]
+                    appender.cover(rows[-1][0], archived_from)
+                with timer.span("count"):
+                    crossed = counter.add(senders)
+                for sender_id, _ in crossed:
+                    sender = users.get(sender_id)
+                    if sender is not None:
+                        entities[sender_id] = sender
+            if newest and not checkpointed.is_set():
+                # No recent messages; the checkpoint is queued after the merge.
+                checkpointed.set()
+            if scanned:
+                self._report_scan(
+                    chat_label,
+                    scanned,
+                    skipped_actions,
+                    skipped_senders,
+                    message_id,
+                    message_date,
+                )
+            if day_counts:
+                edge_days[day] = day_counts
+            return counter, stats, entities, edge_days, top_id, read
+
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(scan(start, end)) for start, end in zip(starts, ends)
+            ]
+        results = [task.result() for task in tasks]
+
+        # Merge newest first, snapshotting the totals at every window start.
+        totals: dict[int, int] = {}
+        entities: dict[int, User] = {}
+        edge_days: dict[date, dict[int, int]] = {}
+        user_counts: dict[int, int] = {}
+        profiles: dict[int, dict[int, int]] = {}
+        stats: UserStats | None = None
+        with timer.span("merge"):
+            for start, (counter, segment_stats, segment_entities, segment_edges, _, _) in zip(
+                starts, results
+            ):
+                for user_id, count in counter.items():
+                    totals[user_id] = totals.get(user_id, 0) + count
+                entities.update(segment_entities)
+                for day, counts in segment_edges.items():
+                    merged = edge_days.setdefault(day, {})
+                    for user_id, count in counts.items():
+                        merged[user_id] = merged.get(user_id, 0) + count
+                if segment_stats is not None:
+                    if stats is None:
+                        stats = segment_stats
+                    else:
+                        stats.merge(segment_stats)
+                for days in window_starts.get(start, ()):
+                    threshold = self.min_messages if days is None else self.window_thresholds[days]
+                    snapshot = {
+                        user_id: count for user_id, count in totals.items() if count > threshold
+                    }
+                    if days is None:
+                        user_counts = snapshot
+                    else:
+                        profiles[days] = snapshot
+
+        saved = 0
+        for user_id, count in user_counts.items():
+            sender = entities.get(user_id)
+            if sender is None:
+                with timer.span("resolve"):
+                    sender = await self._resolve_user(user_id)
+            else:
+                self._remember_sender(user_id, sender)
+            saved += self._save_active_user(chat, chat_id, chat_label, user_id, sender, count)
+
+        for day, counts in edge_days.items():
+            self.writer.add_daily_activity(chat_id, day, counts, False)
+        if appender is not None:
+            appender.flush()
+        self.writer.add_user_counts(chat_id, user_counts)
+        if stats is not None:
+            with timer.span("stats"):
+                self.writer.add_user_stats(chat_id, stats.rows(user_counts))
+        if self.analysis_windows:
+            self._store_window_profiles(chat, chat_id, profiles)
+        self._store_leaderboards(chat_id, user_counts, profiles)
+
+        self.logger.info("Active users found in chat '%s': %s", title, saved)
+        self.logger.info("Stage timings for chat '%s': %s", title, timer.summary())
+        top_id = max(result[-2] for result in results)
+        if not results[0][-1] and top_id:
+            self.writer.add_checkpoint(chat_id, top_id, None, None)
+        return top_id, sum(result[-1] for result in results)
+
+    async def _load_window_profiles(
+        self, chat_id: int, date_to: datetime
+    ) -> dict[int, dict[int, int]]:
+        """Per-window counts from the daily table, once this scan is written."""
+        await self.writer.flush()
+        profiles = {}
+        async with self.sessionmaker() as session:
+            for days, threshold in self.analysis_windows:
+                since = (date_to - timedelta(days=days)).date()
+                profiles[days] = await window_activity(session, chat_id, since, threshold)
+        return profiles
+
+    def _store_window_profiles(
+        self, chat, chat_id: int, profiles: dict[int, dict[int, int]]
+    ) -> None:
+        self.writer.add_window_activity(chat_id, profiles)
+        self.logger.info(
+            "Activity profile of chat '%s': %s",
+            getattr(chat, "title", ""),
+            ", ".join(
+                f"{days}d >{self.window_thresholds[days]}: {len(profiles[days])} users"
+                for days, _ in self.analysis_windows
+            ),
+        )
+
+    def _store_leaderboards(
+        self, chat_id: int, user_counts: dict[int, int], profiles: dict[int, dict[int, int]]
+    ) -> None:
+        """Queue the top users of the ANALYSIS_DAYS window and of every profile window."""
+        if not self.leaderboard_size:
+            return
+        boards = dict(profiles)
+        # A profile window as long as ANALYSIS_DAYS gives way to the primary one.
+        boards[self.analysis_days] = user_counts
+        self.writer.add_leaderboards(
+            chat_id,
+            {
+                days: heapq.nlargest(
+                    self.leaderboard_size,
+                    counts.items(),
+                    # Ties are ranked by user id, so reruns give the same order.
+                    key=lambda item: (item[1], -item[0]),
+                )
+                for days, counts in boards.items()
+            },
+        )
+
+    def _save_active_user(
+        self, chat, chat_id: int, chat_label: str, sender_id: int, sender, count: int
+    ) -> bool:
+        """Queue a sender that crossed the threshold, unless it is filtered out."""
+        reason = self._filter_reason(sender)
+        if reason is not None:
+            self.metrics.inc("parser_senders_filtered_total", chat=chat_label, reason=reason)
+            return False
+
+        self.metrics.inc("parser_active_users_total", chat=chat_label)
+        username = f"@{sender.username}"
+        self.writer.add_active_user(chat_id, sender_id, username, sender.first_name, count)
+        self.logger.info(
+            "Found active user %s (%s) in chat '%s'",
+            sender.first_name,
+            username,
+            getattr(chat, "title", ""),
+        )
+        return True
+
+    async def _load_incremental_state(
+        self, chat_id: int, since: date
+    ) -> tuple[ChatCheckpoint | None, dict[int, int]]:
+        """Return the chat checkpoint and the stored window counts per user.
+
+        Without a checkpoint the stored daily counts cannot be trusted to
+        match the messages seen so far, so they are dropped and rebuilt.
+        """
+        async with self.sessionmaker() as session:
+            checkpoint = await session.get(ChatCheckpoint, chat_id)
+            if checkpoint is None:
+                await session.execute(
+                    delete(UserChatDailyActivity).where(
+                        UserChatDailyActivity.chat_id == chat_id
+                    )
+                )
+                await session.commit()
+                return None, {}
+            return checkpoint, await window_activity(session, chat_id, since)
+
+    def _report_scan(
+        self,
+        chat_label: str,
+        scanned: int,
+        skipped_actions: int,
+        skipped_senders: int,
+        message_id: int,
+        message_date: datetime,
+    ) -> None:
+        metrics = self.metrics
+        metrics.inc("parser_messages_scanned_total", scanned, chat=chat_label)
+        metrics.inc(
+            "parser_messages_filtered_total", skipped_actions, chat=chat_label, reason="action"
+        )
+        metrics.inc(
+            "parser_messages_filtered_total",
+            skipped_senders,
+            chat=chat_label,
+            reason="non_user_sender",
+        )
+        metrics.set("parser_scan_message_id", message_id, chat=chat_label)
+        metrics.set(
+            "parser_scan_message_timestamp_seconds", message_date.timestamp(), chat=chat_label
+        )
+
+    @staticmethod
+    def _filter_reason(sender) -> str | None:
+        """Why a sender cannot be saved as an active user, or None if it can."""
+        if not isinstance(sender, User):
+            return "not_user"
+        if sender.bot:
+            return "bot"
+        if sender.deleted:
+            return "deleted"
+        if not sender.username:
+            return "no_username"
+        return None
+
+    async def _resolve_user(self, user_id: int):
+        # Only reached for senders missing from their history batch.
+        if self.senders is not None:
+            cached, sender = self.senders.get(user_id)
+            self.metrics.inc("parser_sender_cache_total", result="hit" if cached else "miss")
+            if cached:
+                return sender
+        started = time.perf_counter()
+        try:
+            sender = await self.rate.call(self.client.get_entity, PeerUser(user_id), "senders")
+        except ValueError:
+            # get_entity cannot find users the session has never seen.
+            sender = None
+        self.metrics.observe("parser_sender_resolve_seconds", time.perf_counter() - started)
+        self._remember_sender(user_id, sender)
+        return sender
+
+    def _remember_sender(self, user_id: int, sender) -> None:
+        if self.senders is not None:
+            self.writer.add_sender(self.senders.put(user_id, sender))
+
+    async def _warm_sender_cache(self) -> None:
+        """Load unexpired sender cache entries and drop the expired ones."""
+        if self.senders is None:
+            return
+        expired = datetime.utcnow() - timedelta(hours=self.sender_cache_hours)
+        async with self.sessionmaker() as session:
+            await session.execute(
+                delete(SenderCacheEntry).where(SenderCacheEntry.updated_at < expired)
+            )
+            result = await session.execute(select(SenderCacheEntry))
+            self.senders.load(list(result.scalars()))
+            await session.commit()
+        self.logger.info("Loaded %s cached senders", len(self.senders))
 
     async def _iter_dialogs_with_floodwait(self):
         while True:
             try:
+                await self.rate.wait()
                 async for dialog in self.client.iter_dialogs():
                     yield dialog
                 break
             except FloodWaitError as exc:
-                wait_time = exc.seconds + 1
-                self.logger.warning("Flood wait for %s seconds while dialogs", wait_time)
-                await asyncio.sleep(wait_time)
+                await self.rate.flood_wait(exc, "dialogs")
 
-    async def _iter_messages_with_floodwait(self, chat, date_to):
-        offset_id = 0
+    async def _iter_history(
+        self,
+        chat,
+        date_from: datetime,
+        date_to: datetime,
+        timer: StageTimer,
+        offset_id: int = 0,
+        min_id: int = 0,
+    ):
+        """Yield ``(rows, users)`` for each history batch, newest messages first.
+
+        History is read with raw GetHistoryRequest calls instead of
+        ``iter_messages`` to skip building full ``Message`` objects. Each row
+        is a ``(message_id, date, sender_id, is_action, text_len, is_reply,
+        has_media)`` tuple with
+        ``sender_id`` 0 for non-user senders; ``users`` maps the batch's user
+        ids to entities. Reading stops at ``date_from`` or ``min_id``.
+        """
+        peer = await self.client.get_input_entity(chat)
+        offset_date = None if offset_id else date_to
         while True:
-            try:
-                async for message in self.client.iter_messages(
-                    chat, offset_date=date_to, offset_id=offset_id
-                ):
-                    yield message
-                    offset_id = message.id
-                break
-            except FloodWaitError as exc:
-                wait_time = exc.seconds + 1
-                self.logger.warning("Flood wait for %s seconds while messages", wait_time)
-                await asyncio.sleep(wait_time)
+            request = GetHistoryRequest(
+                peer=peer,
+                offset_id=offset_id,
+                offset_date=offset_date,
+                add_offset=0,
+                limit=_HISTORY_LIMIT,
+                max_id=0,
+                min_id=min_id,
+                hash=0,
+            )
+            with timer.span("history"):
+                response = await self.rate.call(self.client, request, "messages", paced=True)
+            messages = getattr(response, "messages", None)
+            if not messages:
+                return
+            with timer.span("project"):
+                rows, finished = _project_history(messages, date_from)
+            if rows:
+                yield rows, {user.id: user for user in response.users}
+            if finished or isinstance(response, MessagesMessages):
+                return
+            offset_id = messages[-1].id
+            offset_date = None
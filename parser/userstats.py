@@ -0,0 +1,243 @@
+"""Per-user message statistics computed with NumPy over buffered columns."""
+
+from __future__ import annotations
+
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+# Inter-message gaps are histogrammed in power-of-two buckets of seconds:
+# [0, 2), [2, 4), ... with the last bucket open-ended (2^23s is about 97 days).
+GAP_BUCKETS = 24
+# Buffered rows per NumPy pass; smaller chunks spend more time in call overhead.
+CHUNK_ROWS = 8192
+_DAY = 86400
+# Day offsets within one chunk fit in the low bits of the (user, day) key.
+_DAY_BITS = 20
+
+
+class UserStats:
+    """Replies, text volume, media, active days and approximate median gap per sender.
+
+    Takes the history rows of one chat, newest first, as the scan yields
+    them. Their fields are buffered as primitive columns and folded into
+    per-user arrays every ``CHUNK_ROWS`` rows; ``rows`` folds the rest.
+    Statistics of an older stretch of the same history, such as another scan
+    segment, are added with ``merge``.
+    """
+
+    def __init__(self, since: datetime) -> None:
+        # Rows older than ``since`` are ignored.
+        self.since = since.timestamp()
+        self._reset_buffer()
+
+        self._index: dict[int, int] = {}
+        self._size = 0
+        capacity = 1024
+        self._replies_total = np.zeros(capacity, dtype=np.int64)
+        self._media_total = np.zeros(capacity, dtype=np.int64)
+        self._text_total = np.zeros(capacity, dtype=np.int64)
+        self._days = np.zeros(capacity, dtype=np.int32)
+        # Newest and oldest day and message time seen so far per user; -1
+        # when none.
+        self._first_day = np.full(capacity, -1, dtype=np.int64)
+        self._first_ts = np.full(capacity, -1.0, dtype=np.float64)
+        self._last_day = np.full(capacity, -1, dtype=np.int64)
+        self._last_ts = np.full(capacity, -1.0, dtype=np.float64)
+        self._gaps = np.zeros((capacity, GAP_BUCKETS), dtype=np.uint32)
+
+    def extend(self, rows: list[tuple]) -> None:
+        """Buffer ``(message_id, date, sender_id, is_action, text_len, is_reply,
+        has_media)`` rows."""
+        _, dates, senders, actions, text_lens, replies, media = zip(*rows)
+        self._senders.extend(senders)
+        self._timestamps.extend(map(datetime.timestamp, dates))
+        self._actions.extend(actions)
+        self._text.extend(text_lens)
+        self._replies.extend(replies)
+        self._media.extend(media)
+        if len(self._senders) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._senders:
+            return
+        senders = np.frombuffer(self._senders, dtype=np.int64)
+        timestamps = np.frombuffer(self._timestamps, dtype=np.float64)
+        # Service messages and non-user senders are not counted, as in the scan.
+        keep = (
+            (senders != 0)
+            & (np.frombuffer(self._actions, dtype=np.int8) == 0)
+            & (timestamps >= self.since)
+        )
+        if keep.any():
+            self._fold(
+                senders[keep],
+                timestamps[keep],
+                np.frombuffer(self._replies, dtype=np.int8)[keep],
+                np.frombuffer(self._media, dtype=np.int8)[keep],
+                np.frombuffer(self._text, dtype=np.int32)[keep],
+            )
+        self._reset_buffer()
+
+    def _reset_buffer(self) -> None:
+        self._senders = array("q")
+        self._timestamps = array("d")
+        self._actions = array("b")
+        self._text = array("i")
+        self._replies = array("b")
+        self._media = array("b")
+
+    def merge(self, older: UserStats) -> None:
+        """Add the statistics of ``older``, whose rows all predate ours."""
+        self.flush()
+        older.flush()
+        if not older._size:
+            return
+        ids = np.fromiter(older._index.keys(), dtype=np.int64, count=older._size)
+        theirs = np.fromiter(older._index.values(), dtype=np.int64, count=older._size)
+        ours = self._slots(ids)
+        known = self._last_ts[ours] >= 0
+
+        self._replies_total[ours] += older._replies_total[theirs]
+        self._media_total[ours] += older._media_total[theirs]
+        self._text_total[ours] += older._text_total[theirs]
+        # A day split between the two stretches was counted by both.
+        shared_day = known & (self._last_day[ours] == older._first_day[theirs])
+        self._days[ours] += older._days[theirs] - shared_day.astype(np.int32)
+        self._gaps[ours] += older._gaps[theirs]
+        joins = self._last_ts[ours][known] - older._first_ts[theirs][known]
+        if len(joins):
+            np.add.at(self._gaps, (ours[known], _gap_buckets(joins)), 1)
+
+        new = ~known
+        self._first_day[ours[new]] = older._first_day[theirs[new]]
+        self._first_ts[ours[new]] = older._first_ts[theirs[new]]
+        self._last_day[ours] = older._last_day[theirs]
+        self._last_ts[ours] = older._last_ts[theirs]
+
+    def rows(self, user_ids) -> dict[int, dict]:
+        """Statistics of ``user_ids`` as column values for ``active_users``."""
+        self.flush()
+        stats = {}
+        for user_id in user_ids:
+            index = self._index.get(user_id)
+            if index is None:
+                continue
+            stats[user_id] = {
+                "reply_count": int(self._replies_total[index]),
+                "media_count": int(self._media_total[index]),
+                "text_chars": int(self._text_total[index]),
+                "active_days": int(self._days[index]),
+                "median_gap_seconds": _median_gap(self._gaps[index]),
+            }
+        return stats
+
+    def _fold(self, senders, timestamps, replies, media, text) -> None:
+        ids, inverse = np.unique(senders, return_inverse=True)
+        slots = self._slots(ids)
+        per_user = len(ids)
+
+        for totals, weights in (
+            (self._replies_total, replies),
+            (self._media_total, media),
+            (self._text_total, text),
+        ):
+            totals[slots] += np.bincount(inverse, weights=weights, minlength=per_user).astype(
+                np.int64
+            )
+
+        # Distinct (user, day) pairs. Days only move backwards, so the one day
+        # a user can already have been counted for is their oldest day so far.
+        days = (timestamps // _DAY).astype(np.int64)
+        first_day = days.min()
+        keys = np.unique(inverse.astype(np.int64) << _DAY_BITS | (days - first_day))
+        pair_users = keys >> _DAY_BITS
+        pair_days = (keys & ((1 << _DAY_BITS) - 1)) + first_day
+        seen = pair_days == self._last_day[slots][pair_users]
+        self._days[slots] += (
+            np.bincount(pair_users, minlength=per_user)
+            - np.bincount(pair_users, weights=seen, minlength=per_user).astype(np.int64)
+        ).astype(np.int32)
+        # Pairs are sorted by user, then day: the first pair is the oldest day.
+        _, first_pair = np.unique(pair_users, return_index=True)
+        last_pair = np.r_[first_pair[1:], len(pair_users)] - 1
+        self._last_day[slots] = pair_days[first_pair]
+
+        # Per user the rows are already newest first; a stable sort keeps that.
+        order = np.argsort(inverse, kind="stable")
+        users = inverse[order]
+        times = timestamps[order]
+        same = users[1:] == users[:-1]
+        gap_users = users[1:][same]
+        gaps = times[:-1][same] - times[1:][same]
+        # Gap between the oldest message of the previous chunks and the newest here.
+        starts = np.flatnonzero(np.r_[True, ~same])
+        ends = np.r_[starts[1:], len(users)] - 1
+        previous = self._last_ts[slots]
+        carried = previous >= 0
+        gap_users = np.concatenate([gap_users, np.flatnonzero(carried)])
+        gaps = np.concatenate([gaps, previous[carried] - times[starts][carried]])
+        new = slots[~carried]
+        self._first_ts[new] = times[starts][~carried]
+        self._first_day[new] = pair_days[last_pair][~carried]
+        self._last_ts[slots] = times[ends]
+        if len(gaps):
+            np.add.at(self._gaps, (slots[gap_users], _gap_buckets(gaps)), 1)
+
+    def _slots(self, ids: np.ndarray) -> np.ndarray:
+        index = self._index
+        slots = np.empty(len(ids), dtype=np.int64)
+        for position, user_id in enumerate(ids.tolist()):
+            slot = index.get(user_id)
+            if slot is None:
+                slot = index[user_id] = self._size
+                self._size += 1
+            slots[position] = slot
+        if self._size > len(self._days):
+            self._grow(self._size)
+        return slots
+
+    def _grow(self, size: int) -> None:
+        capacity = max(size, 2 * len(self._days))
+
+        def grown(column: np.ndarray, fill) -> np.ndarray:
+            shape = (capacity,) + column.shape[1:]
+            result = np.full(shape, fill, dtype=column.dtype)
+            result[: len(column)] = column
+            return result
+
+        self._replies_total = grown(self._replies_total, 0)
+        self._media_total = grown(self._media_total, 0)
+        self._text_total = grown(self._text_total, 0)
+        self._days = grown(self._days, 0)
+        self._first_day = grown(self._first_day, -1)
+        self._first_ts = grown(self._first_ts, -1.0)
+        self._last_day = grown(self._last_day, -1)
+        self._last_ts = grown(self._last_ts, -1.0)
+        self._gaps = grown(self._gaps, 0)
+
+
+def _gap_buckets(gaps: np.ndarray) -> np.ndarray:
+    return np.minimum(np.log2(np.maximum(gaps, 1.0)).astype(np.int64), GAP_BUCKETS - 1)
+
+
+def _median_gap(histogram: np.ndarray) -> int | None:
+    """Approximate median gap in seconds, interpolated within its power-of-two bucket.
+
+    The gaps themselves are not kept, so the result can be off by a few
+    percent of the exact median.
+    """
+    cumulative = np.cumsum(histogram)
+    total = int(cumulative[-1])
+    if not total:
+        return None
+    middle = total / 2
+    bucket = int(np.searchsorted(cumulative, middle))
+    before = int(cumulative[bucket - 1]) if bucket else 0
+    fraction = (middle - before) / int(histogram[bucket])
+    if bucket == 0:
+        return round(2 * fraction)
+    # Gaps are spread roughly evenly on a log scale within a bucket.
+    return round(2 ** (bucket + fraction))
@@ -0,0 +1,511 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, case, delete, insert, update
+
+from db.models import (
+    ActiveUser,
+    ChatCheckpoint,
+    ChatLeaderboard,
+    ChatSchedule,
+    SenderCacheEntry,
+    UserChatDailyActivity,
+    UserWindowActivity,
+)
+from db.session import upsert_insert
+from parser.metrics import Metrics
+
+_STOP = object()
+_ACTIVE_USER = "active_user"
+_USER_COUNTS = "user_counts"
+_USER_STATS = "user_stats"
+_CHECKPOINT = "checkpoint"
+_DAILY_ADD = "daily_add"
+_DAILY_MAX = "daily_max"
+_WINDOWS = "windows"
+_SENDER = "sender"
+_SCHEDULE = "schedule"
+_LEADERBOARDS = "leaderboards"
+# asyncpg allows at most 32767 bind parameters per statement.
+_MAX_PARAMS = 32767
+
+_active_users = ActiveUser.__table__
+_UPDATE_USER_COUNTS = (
+    update(_active_users)
+    .where(
+        _active_users.c.user_id == bindparam("b_user_id"),
+        _active_users.c.chat_id == bindparam("b_chat_id"),
+    )
+    .values(message_count=bindparam("b_message_count"), last_seen=bindparam("b_last_seen"))
+)
+_STAT_COLUMNS = ("reply_count", "media_count", "text_chars", "active_days", "median_gap_seconds")
+_UPDATE_USER_STATS = (
+    update(_active_users)
+    .where(
+        _active_users.c.user_id == bindparam("b_user_id"),
+        _active_users.c.chat_id == bindparam("b_chat_id"),
+    )
+    .values({column: bindparam(f"b_{column}") for column in _STAT_COLUMNS})
+)
+
+
+def _chunk_rows(table) -> int:
+    """Rows per multi-row INSERT that stay within ``_MAX_PARAMS`` for ``table``."""
+    return _MAX_PARAMS // len(table.columns)
+
+
+class BatchWriter:
+    """Write-behind persistence for parser results.
+
+    Producers enqueue rows without waiting on the database; a background task
+    writes them in batches once ``batch_size`` rows are pending or
+    ``flush_interval`` seconds have passed since the first pending row.
+
+    A failed batch is retried ``retries`` times with exponential backoff.
+    If it still fails the writer stops: rows queued after it are discarded,
+    since a later checkpoint could otherwise point past the lost rows, and
+    the error is raised from ``flush``, ``close`` and every ``add_*`` call.
+    """
+
+    def __init__(
+        self,
+        sessionmaker,
+        batch_size: int,
+        flush_interval: float,
+        metrics: Metrics,
+        logger: logging.Logger,
+        retries: int = 5,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.sessionmaker = sessionmaker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.logger = logger
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.rows_written = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self._error: BaseException | None = None
+
+    async def __aenter__(self) -> BatchWriter:
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add_active_user(
+        self,
+        chat_id: int,
+        user_id: int,
+        username: str,
+        first_name: str | None,
+        message_count: int,
+    ) -> None:
+        """Queue an active user; a user already saved for the chat is updated."""
+        self._put(
+            (
+                _ACTIVE_USER,
+                {
+                    "chat_id": chat_id,
+                    "user_id": user_id,
+                    "username": username,
+                    "first_name": first_name,
+                    "message_count": message_count,
+                    "last_seen": datetime.utcnow(),
+                },
+            )
+        )
+
+    def add_user_counts(self, chat_id: int, counts: dict[int, int]) -> None:
+        """Queue final message counts of a chat's users.
+
+        Only users already saved in ``active_users`` are updated.
+        """
+        self._put((_USER_COUNTS, (chat_id, counts, datetime.utcnow())))
+
+    def add_user_stats(self, chat_id: int, stats: dict[int, dict]) -> None:
+        """Queue activity details of a chat's users, keyed by ``active_users`` column.
+
+        Only users already saved in ``active_users`` are updated.
+        """
+        self._put((_USER_STATS, (chat_id, stats)))
+
+    def add_checkpoint(
+        self,
+        chat_id: int,
+        last_message_id: int,
+        scan_top_id: int | None,
+        offset_id: int | None,
+        daily: dict[date, dict[int, int]] | None = None,
+    ) -> None:
+        """Queue a scan checkpoint.
+
+        Checkpoints are written no earlier than the rows queued before them,
+        so a saved offset never points past unsaved results. ``daily`` holds
+        additive per-day counts of the messages up to the checkpoint; they are
+        committed together with it, so a resumed scan never adds them twice.
+        """
+        self._put(
+            (
+                _CHECKPOINT,
+                (
+                    {
+                        "chat_id": chat_id,
+                        "last_message_id": last_message_id,
+                        "scan_top_id": scan_top_id,
+                        "offset_id": offset_id,
+                        "updated_at": datetime.utcnow(),
+                    },
+                    daily or {},
+                ),
+            )
+        )
+
+    def add_daily_activity(
+        self, chat_id: int, day: date, counts: dict[int, int], additive: bool
+    ) -> None:
+        """Queue per-user message counts of one chat day.
+
+        Additive counts are added to the stored ones; they must only cover
+        messages that were never counted before, and counts that a checkpoint
+        depends on go through ``add_checkpoint`` instead. Otherwise the stored count is
+        replaced when the new one is larger, which keeps full rescans of the
+        same day idempotent.
+        """
+        self._put((_DAILY_ADD if additive else _DAILY_MAX, (chat_id, day, counts)))
+
+    def add_window_activity(self, chat_id: int, profiles: dict[int, dict[int, int]]) -> None:
+        """Queue per-window user counts of a chat, replacing the stored ones."""
+        self._put((_WINDOWS, (chat_id, profiles, datetime.utcnow())))
+
+    def add_sender(self, row: dict) -> None:
+        """Queue a ``sender_cache`` row, replacing the stored entry of the user."""
+        self._put((_SENDER, row))
+
+    def add_leaderboards(self, chat_id: int, boards: dict[int, list[tuple[int, int]]]) -> None:
+        """Queue ranked ``(user_id, count)`` lists per window, replacing the stored ones."""
+        self._put((_LEADERBOARDS, (chat_id, boards, datetime.utcnow())))
+
+    def add_chat_schedule(self, row: dict) -> None:
+        """Queue the refresh cadence of a chat, written after the rows queued before it."""
+        self._put((_SCHEDULE, row))
+
+    async def flush(self) -> None:
+        """Wait until every row queued so far has been written."""
+        await self._queue.join()
+        self._check()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+
+    def _put(self, item) -> None:
+        self._check()
+        self._queue.put_nowait(item)
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Batch writer stopped after a failed write") from self._error
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                await self._write(batch)
+            except Exception as exc:
+                self._error = exc
+                # Release flush() callers; nothing queued after the lost batch is written.
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                raise
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: list[tuple[str, object]]) -> None:
+        active_users: dict[tuple[int, int], dict] = {}
+        user_counts: dict[tuple[int, int], dict] = {}
+        user_stats: dict[tuple[int, int], dict] = {}
+        checkpoints: dict[int, dict] = {}
+        daily_add: dict[tuple[int, int, date], int] = {}
+        daily_max: dict[tuple[int, int, date], int] = {}
+        windows: dict[int, list[dict]] = {}
+        senders: dict[int, dict] = {}
+        schedules: dict[int, dict] = {}
+        leaderboards: dict[int, list[dict]] = {}
+        for kind, row in batch:
+            if kind == _ACTIVE_USER:
+                active_users[(row["user_id"], row["chat_id"])] = row
+            elif kind == _USER_COUNTS:
+                chat_id, counts, seen = row
+                for user_id, count in counts.items():
+                    key = (user_id, chat_id)
+                    if key in active_users:
+                        active_users[key].update(message_count=count, last_seen=seen)
+                    else:
+                        user_counts[key] = {
+                            "b_user_id": user_id,
+                            "b_chat_id": chat_id,
+                            "b_message_count": count,
+                            "b_last_seen": seen,
+                        }
+            elif kind == _USER_STATS:
+                chat_id, stats = row
+                for user_id, values in stats.items():
+                    user_stats[(user_id, chat_id)] = {
+                        "b_user_id": user_id,
+                        "b_chat_id": chat_id,
+                        **{f"b_{column}": values[column] for column in _STAT_COLUMNS},
+                    }
+            elif kind == _CHECKPOINT:
+                checkpoint, daily = row
+                # Only the latest checkpoint per chat matters.
+                checkpoints[checkpoint["chat_id"]] = checkpoint
+                for day, counts in daily.items():
+                    for user_id, count in counts.items():
+                        key = (checkpoint["chat_id"], user_id, day)
+                        daily_add[key] = daily_add.get(key, 0) + count
+            elif kind == _DAILY_ADD:
+                chat_id, day, counts = row
+                for user_id, count in counts.items():
+                    key = (chat_id, user_id, day)
+                    daily_add[key] = daily_add.get(key, 0) + count
+            elif kind == _DAILY_MAX:
+                chat_id, day, counts = row
+                for user_id, count in counts.items():
+                    key = (chat_id, user_id, day)
+                    daily_max[key] = max(daily_max.get(key, 0), count)
+            elif kind == _WINDOWS:
+                # A later profile of the same chat replaces an earlier one.
+                chat_id, profiles, computed_at = row
+                windows[chat_id] = [
+                    {
+                        "chat_id": chat_id,
+                        "window_days": days,
+                        "user_id": user_id,
+                        "message_count": count,
+                        "computed_at": computed_at,
+                    }
+                    for days, counts in profiles.items()
+                    for user_id, count in counts.items()
+                ]
+            elif kind == _SENDER:
+                senders[row["user_id"]] = row
+            elif kind == _SCHEDULE:
+                schedules[row["chat_id"]] = row
+            elif kind == _LEADERBOARDS:
+                chat_id, boards, computed_at = row
+                leaderboards[chat_id] = [
+                    {
+                        "chat_id": chat_id,
+                        "window_days": days,
+                        "rank": rank,
+                        "user_id": user_id,
+                        "message_count": count,
+                        "computed_at": computed_at,
+                    }
+                    for days, entries in boards.items()
+                    for rank, (user_id, count) in enumerate(entries, start=1)
+                ]
+
+        async def commit() -> None:
+            async with self.sessionmaker() as session:
+                await self._upsert_active_users(session, list(active_users.values()))
+                if user_counts:
+                    await session.execute(_UPDATE_USER_COUNTS, list(user_counts.values()))
+                # After the upsert, so users inserted by this batch are updated too.
+                if user_stats:
+                    await session.execute(_UPDATE_USER_STATS, list(user_stats.values()))
+                await self._upsert_daily(session, daily_add, additive=True)
+                await self._upsert_daily(session, daily_max, additive=False)
+                await self._replace_windows(session, windows)
+                await self._replace_leaderboards(session, leaderboards)
+                await self._upsert_senders(session, list(senders.values()))
+                if schedules:
+                    stmt = upsert_insert(session, ChatSchedule).values(list(schedules.values()))
+                    await session.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=[ChatSchedule.chat_id],
+                            set_={
+                                "top_id": stmt.excluded.top_id,
+                                "messages_per_hour": stmt.excluded.messages_per_hour,
+                                "last_run_at": stmt.excluded.last_run_at,
+                                "next_run_at": stmt.excluded.next_run_at,
+                            },
+                        )
+                    )
+                if checkpoints:
+                    stmt = upsert_insert(session, ChatCheckpoint).values(
+                        list(checkpoints.values())
+                    )
+                    await session.execute(
+                        stmt.on_conflict_do_update(
+                            index_elements=[ChatCheckpoint.chat_id],
+                            set_={
+                                "last_message_id": stmt.excluded.last_message_id,
+                                "scan_top_id": stmt.excluded.scan_top_id,
+                                "offset_id": stmt.excluded.offset_id,
+                                "updated_at": stmt.excluded.updated_at,
+                            },
+                        )
+                    )
+                await session.commit()
+
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                await commit()
+                break
+            except Exception:
+                if attempt == self.retries:
+                    self.logger.exception(
+                        "Failed to write %s active users, %s daily counts and %s checkpoints",
+                        len(active_users) + len(user_counts) + len(user_stats),
+                        len(daily_add) + len(daily_max),
+                        len(checkpoints),
+                    )
+                    raise
+                delay = self.retry_delay * 2**attempt
+                self.logger.warning(
+                    "Batch write failed, retrying in %.1fs", delay, exc_info=True
+                )
+                await asyncio.sleep(delay)
+        rows = (
+            len(active_users)
+            + len(user_counts)
+            + len(user_stats)
+            + len(daily_add)
+            + len(daily_max)
+            + sum(len(window_rows) for window_rows in windows.values())
+            + sum(len(board_rows) for board_rows in leaderboards.values())
+            + len(senders)
+            + len(schedules)
+            + len(checkpoints)
+        )
+        self.rows_written += rows
+        self.metrics.observe("parser_db_flush_seconds", time.perf_counter() - started)
+        self.metrics.inc("parser_db_rows_written_total", rows)
+        if active_users:
+            self.logger.info("Flushed %s active users", len(active_users))
+
+    @staticmethod
+    async def _replace_windows(session, windows: dict[int, list[dict]]) -> None:
+        for chat_id, rows in windows.items():
+            await session.execute(
+                delete(UserWindowActivity).where(UserWindowActivity.chat_id == chat_id)
+            )
+            if rows:
+                await session.execute(insert(UserWindowActivity.__table__), rows)
+
+    @staticmethod
+    async def _replace_leaderboards(session, leaderboards: dict[int, list[dict]]) -> None:
+        for chat_id, rows in leaderboards.items():
+            await session.execute(
+                delete(ChatLeaderboard).where(ChatLeaderboard.chat_id == chat_id)
+            )
+            if rows:
+                await session.execute(insert(ChatLeaderboard.__table__), rows)
+
+    @staticmethod
+    async def _upsert_senders(session, rows: list[dict]) -> None:
+        table = SenderCacheEntry.__table__
+        chunk = _chunk_rows(table)
+        for start in range(0, len(rows), chunk):
+            stmt = upsert_insert(session, table).values(rows[start : start + chunk])
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[table.c.user_id],
+                    set_={
+                        "found": stmt.excluded.found,
+                        "bot": stmt.excluded.bot,
+                        "deleted": stmt.excluded.deleted,
+                        "username": stmt.excluded.username,
+                        "first_name": stmt.excluded.first_name,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+            )
+
+    @staticmethod
+    async def _upsert_active_users(session, rows: list[dict]) -> None:
+        table = ActiveUser.__table__
+        chunk = _chunk_rows(table)
+        for start in range(0, len(rows), chunk):
+            stmt = upsert_insert(session, table).values(rows[start : start + chunk])
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[table.c.user_id, table.c.chat_id],
+                    set_={
+                        "username": stmt.excluded.username,
+                        "first_name": stmt.excluded.first_name,
+                        "message_count": stmt.excluded.message_count,
+                        "last_seen": stmt.excluded.last_seen,
+                    },
+                )
+            )
+
+    @staticmethod
+    async def _upsert_daily(
+        session, counts: dict[tuple[int, int, date], int], additive: bool
+    ) -> None:
+        rows = [
+            {"chat_id": chat_id, "user_id": user_id, "day": day, "message_count": count}
+            for (chat_id, user_id, day), count in counts.items()
+        ]
+        table = UserChatDailyActivity.__table__
+        chunk = _chunk_rows(table)
+        for start in range(0, len(rows), chunk):
+            stmt = upsert_insert(session, table).values(rows[start : start + chunk])
+            if additive:
+                message_count = table.c.message_count + stmt.excluded.message_count
+            else:
+                message_count = case(
+                    (
+                        stmt.excluded.message_count > table.c.message_count,
+                        stmt.excluded.message_count,
+                    ),
+                    else_=table.c.message_count,
+                )
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[table.c.chat_id, table.c.user_id, table.c.day],
+                    set_={"message_count": message_count},
+                )
+            )
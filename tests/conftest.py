@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Lets a plain `pytest` import the project packages without installing them.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,131 @@
+"""A segmented scan stores the same results as a sequential one."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import text
+
+import parser.service
+from bench.fake_client import FakeChat, FakeTelegramClient, SyntheticChatSpec
+from config.settings import load_settings
+from db.session import create_engine, create_sessionmaker, init_db
+from parser.metrics import Metrics
+from parser.ratelimit import RateController
+from parser.service import TelegramParser
+from parser.writer import BatchWriter
+
+NOW = datetime(2026, 10, 17, 13, 30, tzinfo=timezone.utc)
+
+# Columns that do not depend on when the rows were written.
+QUERIES = {
+    "active_users": (
+        "SELECT user_id, chat_id, username, first_name, message_count, reply_count,"
+        " media_count, text_chars, active_days, median_gap_seconds"
+        " FROM active_users ORDER BY user_id"
+    ),
+    "daily": (
+        "SELECT chat_id, user_id, day, message_count FROM user_chat_daily_activity"
+        " ORDER BY chat_id, user_id, day"
+    ),
+    "windows": (
+        "SELECT chat_id, window_days, user_id, message_count FROM user_window_activity"
+        " ORDER BY chat_id, window_days, user_id"
+    ),
+    "leaderboards": (
+        "SELECT chat_id, window_days, rank, user_id, message_count FROM chat_leaderboard"
+        " ORDER BY chat_id, window_days, rank"
+    ),
+}
+
+
+class FixedDateTime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW if tz is not None else NOW.replace(tzinfo=None)
+
+
+async def scan(database_url: str, chat: FakeChat, segments: int, counter: str) -> dict:
+    engine = create_engine(database_url)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    metrics = Metrics()
+    logger = logging.getLogger("test")
+    async with BatchWriter(sessionmaker, 500, 0.05, metrics, logger) as writer:
+        parser = TelegramParser(
+            client=FakeTelegramClient([chat]),
+            sessionmaker=sessionmaker,
+            writer=writer,
+            target_chat_names=[chat.entity.title],
+            analysis_days=7,
+            min_messages=50,
+            analysis_windows=[(1, 10), (3, 30), (10, 80)],
+            concurrency=1,
+            segments=segments,
+            incremental=False,
+            checkpoint_every=1000,
+            archive=None,
+            counter_mode=counter,
+            heavy_capacity=200,
+            user_stats=True,
+            sender_cache_hours=0,
+            leaderboard_size=20,
+            rate=RateController(0, 5, metrics, logger),
+            metrics=metrics,
+            logger=logger,
+        )
+        await parser._analyze_chat(chat.entity)
+    async with engine.connect() as conn:
+        tables = {
+            name: [tuple(row) for row in await conn.execute(text(query))]
+            for name, query in QUERIES.items()
+        }
+    await engine.dispose()
+    return tables
+
+
+def synthetic_chat() -> FakeChat:
+    spec = SyntheticChatSpec(messages=30_000, users=2_000, days=12, seed=3)
+    return FakeChat.generate(spec, NOW)
+
+
+@pytest.mark.parametrize("counter", ["exact", "compact"])
+def test_segmented_scan_matches_sequential(tmp_path, monkeypatch, counter):
+    monkeypatch.setattr(parser.service, "datetime", FixedDateTime)
+    chat = synthetic_chat()
+
+    sequential = asyncio.run(scan(f"sqlite+aiosqlite:///{tmp_path}/a.db", chat, 1, counter))
+    segmented = asyncio.run(scan(f"sqlite+aiosqlite:///{tmp_path}/b.db", chat, 4, counter))
+
+    assert sequential["active_users"]
+    for name in QUERIES:
+        assert segmented[name] == sequential[name], name
+
+
+def test_heavy_counter_scans_sequentially(tmp_path, monkeypatch):
+    # Space-Saving summaries of separate segments do not merge exactly, so
+    # heavy counting ignores the segment count.
+    async def segmented(self, chat):
+        raise AssertionError("heavy counting must not use a segmented scan")
+
+    monkeypatch.setattr(parser.service, "datetime", FixedDateTime)
+    monkeypatch.setattr(TelegramParser, "_analyze_chat_segmented", segmented)
+    chat = synthetic_chat()
+
+    sequential = asyncio.run(scan(f"sqlite+aiosqlite:///{tmp_path}/a.db", chat, 1, "heavy"))
+    requested = asyncio.run(scan(f"sqlite+aiosqlite:///{tmp_path}/b.db", chat, 4, "heavy"))
+
+    assert sequential["active_users"]
+    assert requested == sequential
+
+
+def test_settings_reject_segments_with_heavy_counter(monkeypatch):
+    monkeypatch.setenv("TARGET_CHAT_NAMES", "chat")
+    monkeypatch.setenv("PARSER_SEGMENTS", "4")
+    monkeypatch.setenv("PARSER_COUNTER", "heavy")
+
+    with pytest.raises(ValueError, match="PARSER_SEGMENTS"):
+        load_settings()